@@ -20,6 +20,8 @@ import time
 # import datetime
 
 terminator=b'\r'
+plot_points  = 50     # Redraw graphs during sweep after this many new points ...
+plot_interval= 0.5    # ... or after this time [s], whatever comes first
 
 #%% Result structure
 class te_result:  # Initialise with impossible values. To be set at object creation
@@ -176,7 +178,10 @@ class te300x:
         self.res.Z    = np.stack( ( np.array(rep[0]) , np.array(rep[1]) ) ) 
         return rep
    
-    def read_sweep_point_by_point( self, resultgraph = [], resultfig = [] ):  
+    def read_sweep_point_by_point( self, resultgraph = [], resultfig = [], 
+                                   update_points = plot_points, update_interval = plot_interval ):  
+        # Graphs are redrawn in batches, every update_points points or update_interval seconds.
+        # A full redraw for every point is slower than the analyser, and would stall the serial read
         n_old = len(self.res.f)
         if n_old == self.res.npts:
             f      = self.res.f.copy()
@@ -191,6 +196,8 @@ class te300x:
         header   = self.read_text()
         finished = False
         nf       = 0
+        nf_plotted= 0
+        t_plotted = time.perf_counter()
         while not(finished):               
             ret= self.read_sweep_line()
             finished = ret[3] or (nf >= self.res.npts )
@@ -198,15 +205,25 @@ class te300x:
                 f[nf]     = ret[0] 
                 Zmag[nf]  = ret[1] 
                 Zphase[nf]= np.radians(ret[2])   # Phase is saved as radians but plotted as degrees
-                if resultgraph and resultfig:
-                    resultgraph[0].set_data( f/1e6, Zmag ) 
-                    resultgraph[1].set_data( f/1e6, np.degrees( Zphase ) ) 
-                    resultfig.canvas.draw()            # --- TRY: Probably necessary
-                    resultfig.canvas.flush_events()    # --- TRY: Probably unnecessary if called in program                
                 nf+=1
+                if resultgraph and resultfig:
+                    t_now = time.perf_counter()
+                    if ( nf-nf_plotted >= update_points ) or ( t_now-t_plotted >= update_interval ):
+                        self.plot_sweep( f, Zmag, Zphase, resultgraph, resultfig )
+                        nf_plotted = nf
+                        t_plotted  = t_now
+        if resultgraph and resultfig and ( nf > nf_plotted ):   # Points after last redraw
+            self.plot_sweep( f, Zmag, Zphase, resultgraph, resultfig )
         Z = np.stack(( np.array(Zmag), np.array(Zphase) ))
         Z = np.require( Z.T, requirements='C' )   # Transpose and ensure 'c-contiguous' array
         self.res.f  = f.copy()
         self.res.Z  = Z.copy()
         self.res.nf = nf
         return 0    
+
+    def plot_sweep( self, f, Zmag, Zphase, resultgraph, resultfig ):
+        resultgraph[0].set_data( f/1e6, Zmag ) 
+        resultgraph[1].set_data( f/1e6, np.degrees( Zphase ) )   # Phase is saved as radians but plotted as degrees
+        resultfig.canvas.draw_idle()
+        resultfig.canvas.flush_events()   # Process pending draw and GUI events
+        return 0
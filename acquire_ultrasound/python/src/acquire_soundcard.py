@@ -28,7 +28,7 @@ sd.default.channels = 2  # Chech that this is available, see list in devices
 sd.default.latency = 'high'
 
 # RF-filter, for display only.Two-way zero-phase Butterworth
-rf_filter.sample_rate = fs
+rf_filter.fs = fs
 rf_filter.type = 'No'           # 'No', 'AC', 'BPF'
 rf_filter.f_min = 0.5e6         # Lower cutoff, Hz
 rf_filter.f_max = 20e6          # Upper cutoff, Hz
@@ -5,7 +5,9 @@ Picoscope 5000-series osciloscopes.
 GUI interface made in Qt Designer, ver. 5.
 Based on earlier NI LabWindows, LabVIEW and Matlab programs. Result file format
 is compatible with these, but smaller modifications may be
-required in some cases.
+required in some cases. Traces saved as raw ADC counts, an option in the
+GUI, are read only by ultrasound_utilities. Recorded traces are stored in a
+series file, one record per trace, read by WaveformSeries.
 
 Operation
     Sets up a GUI to control the system
@@ -21,13 +23,21 @@ Created on Tue Dec 20 22:20:43 2022
 # %% Libraries
 
 # General
+import os
 import sys
-from PyQt5 import QtWidgets, uic           # For setup with Qt
+import time
+import threading
+import queue
+from PyQt5 import QtWidgets, QtCore, uic   # For setup with Qt
 import numpy as np
 import matplotlib
 import matplotlib.colors as mcolors
 import ultrasound_utilities as us         # USN ultrasound lab specific
 import ps5000a_ultrasound_wrappers as ps  # Interface to Pico c-style library
+try:
+    import pyqtgraph_display as pgd       # Optional, faster live display
+except ImportError:
+    pgd = None
 
 
 # Constants
@@ -46,6 +56,13 @@ FREQUENCYSCALE = 1E6
 
 V_MAX = 20           # Absolute maximum voltage scale
 
+QUEUE_LENGTH = 2            # Traces waiting for display, newer are dropped
+STATUS_INTERVAL = 1.0       # [s] Update of rate statistics in status bar
+STOP_TIMEOUT = 2.0          # [s] Wait for acquisition thread to stop
+
+# Live display by "matplotlib" or "pyqtgraph". matplotlib if not installed
+DISPLAY_BACKEND = os.environ.get("ULTRASOUND_DISPLAY", "matplotlib")
+
 
 # %% Set up GUI from Qt5
 matplotlib.use('Qt5Agg')
@@ -58,16 +75,32 @@ oscilloscope_main_window, QtBaseClass = uic.loadUiType(
 class Display:
     """Settings for display on screen during runtime.
 
+    Snapshot of the display settings in the GUI. The settings are read
+    when a widget changes, not for every trace. The flag 'changed' tells
+    that axes and markers must be updated before the next trace is drawn.
+
     Attributes
     ----------
     t_min   Float               Start time of part of trace to be analysed
     t_max   Float               End time of part of trace to be analysed
     channel List of Boolean     Channels to display on screen
+    t_lim   Array of float      Selected interval, 'zoom' [s]
+    f_lim   Array of float      Frequency axis limits, display units
+    db_lim  Array of float      Power spectrum limits [dB]
+    v_zoom  List of float       Vertical scale of selected interval [V]
+    n_pixels Integer            Width of full trace plot, pixels
+    changed Boolean             Settings changed, axes must be updated
     """
 
     t_min = 0
     t_max = 10
     channel = [True, True]
+    t_lim = np.array([0, 10e-6])
+    f_lim = np.array([0, 10])
+    db_lim = np.array([-40, 0])
+    v_zoom = [1.0, 1.0]
+    n_pixels = 1000
+    changed = True
 
 
 class AcquisitionControl:
@@ -78,11 +111,76 @@ class AcquisitionControl:
     oscilloscope_ready  Boolean     Osciloscope connected and ready to acquire
     stop_acquisition    Boolean     Stop data acquisition, do not quit program
     sampling_changed    Boolean     Sampling updated
+    error               Exception   Error that stopped acquisition thread
     """
 
     oscilloscope_ready = False
     stop_acquisition = False
     sampling_changed = True
+    error = None
+
+
+class BlitRenderer:
+    """Redraw only traces on screen, other graphics are kept as background.
+
+    Axes, grid, labels, markers and pulser graphs are drawn once, and the
+    image is stored as background. For each new trace, the background is
+    restored and only the traces are drawn on top (blitting). A full
+    redraw is needed only when axes or markers change, the background
+    is then stored again automatically.
+
+    Attributes
+    ----------
+    fig         Handle              Figure to draw in
+    artists     List of handles     Graphs updated for each trace
+    background  Image               Stored figure, without artists
+    """
+
+    def __init__(self, fig, artists):
+        """Mark artists as animated, and store background at each draw."""
+        self.fig = fig
+        self.artists = artists
+        self.background = None
+        for artist in artists:
+            artist.set_animated(True)   # Not drawn in full redraw
+        fig.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        """Store background after full redraw, then draw artists."""
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+        return 0
+
+    def draw_artists(self):
+        """Draw the animated artists."""
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
+        return 0
+
+    def redraw(self):
+        """Full redraw, after change in axes, markers etc."""
+        self.fig.canvas.draw()
+        return 0
+
+    def update(self):
+        """Draw new traces on stored background."""
+        if self.background is None:
+            return self.redraw()
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        self.draw_artists()
+        canvas.blit(self.fig.bbox)    # Painted when Qt event loop runs
+        return 0
+
+    def connect_resize(self, function):
+        """Call function(event) when the figure is resized."""
+        self.fig.canvas.mpl_connect('resize_event', function)
+        return 0
+
+    def close(self):
+        """Close figure window."""
+        matplotlib.pyplot.close(self.fig)
+        return 0
 
 
 class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
@@ -103,21 +201,44 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
         self.trigger = ps.Trigger()      # Trigger configuration
         self.sampling = ps.Horizontal()  # Horisontal configuration (time)
         self.wfm = us.Waveform()         # Result, storing acquired traces
+        self.wfm_average = us.Waveform()  # Running average, as displayed
         self.pulse = us.Pulse()          # Pulse for function generator output
         self.rf_filter = us.WaveformFilter()  # Filtering, for display only
+        self.recorder = None             # Continuous recording to file
+        self.acquisition_lock = threading.Lock()  # Instrument and recorder
+        self.acquisition_thread = None
+        self.trace_queue = queue.Queue(maxsize=QUEUE_LENGTH)
+        self.display_timer = QtCore.QTimer()
+        self.display_timer.timeout.connect(self.display_trace)
+        self.pipeline = us.DisplayPipeline(self.rf_filter,
+                                           scale="dB", normalise=True,
+                                           time_scale=TIMESCALE,
+                                           frequency_scale=FREQUENCYSCALE)
+        self.running_average = us.RunningAverage(n_average=1)  # All traces
+        self.rates = us.RateMonitor(interval=STATUS_INTERVAL)  # Statistics
         self.pulse.dt = 1/ps.DAC_SAMPLERATE
 
         # Open gui and connect initailse graphs
         self.connect_gui()
-        fig, axis, graph = self.define_graphs()
+        if DISPLAY_BACKEND == "pyqtgraph" and pgd is not None:
+            fig, axis, graph = self.define_graphs_pyqtgraph()
+            self.renderer = pgd.Renderer(fig, axis["trace"][0])
+        else:
+            fig, axis, graph = self.define_graphs()
+            traces = [line for ch_name in ps.CH_NAMES
+                      for line in graph[ch_name]]
+            self.renderer = BlitRenderer(fig, traces)
         self.fig = fig
         self.axis = axis
         self.graph = graph
+        self.renderer.connect_resize(self.display_resized)
+        self.update_display_rate()
 
         self.update_connected_box("Not Connected", COLOR_WARNING)
         self.acquireButton.setEnabled(False)
         self.transmitButton.setEnabled(False)
         self.saveButton.setEnabled(False)
+        self.recordButton.setEnabled(False)
 
 # %% Connect and disconnect oscilloscope
 
@@ -175,7 +296,7 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
     def close_connection(self):
         """Close instrument connection, does not stop program."""
         self.statusBar.showMessage("Closing")
-        matplotlib.pyplot.close(self.fig)
+        self.renderer.close()
         try:
             self.dso.status = ps.close_adc(self.dso)
             errorcode = 0
@@ -205,11 +326,14 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
             self.channel[k].bwl = bwl.lower()[0:2] != 'no'
 
         if self.dso.connected:
-            for k in range(len(self.channel)):
-                self.channel[k].no = k
-                self.dso.status = ps.set_vertical(self.dso, self.channel[k])
-                self.dso.status = ps.set_bwl(self.dso, self.channel[k])
+            with self.acquisition_lock:
+                for k in range(len(self.channel)):
+                    self.channel[k].no = k
+                    self.dso.status = ps.set_vertical(self.dso,
+                                                      self.channel[k])
+                    self.dso.status = ps.set_bwl(self.dso, self.channel[k])
 
+        self.update_display()
         return self.dso.status
 
     def update_trigger(self):
@@ -223,8 +347,10 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
         self.sampling.trigger_position = self.triggerPositionSpinBox.value()
 
         if self.dso.connected:
-            self.dso.status = ps.set_trigger(self.dso, self.trigger,
-                                             self.channel, self.sampling)
+            with self.acquisition_lock:
+                self.dso.status = ps.set_trigger(self.dso, self.trigger,
+                                                 self.channel, self.sampling)
+        self.update_display()
         return self.dso.status
 
     def update_sampling(self):
@@ -234,16 +360,20 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
         """
         # Find oscilloscope timebase from sample rate
         fs_requested = int(self.samplerateSpinBox.value()*FREQUENCYSCALE)
-        self.sampling.timebase, fs_actual = ps.find_timebase(fs_requested)
-        self.sampling.dt = 1/fs_actual
-        self.sampling.n_samples = int(self.nSamplesSpinBox.value()*1e3)
+        with self.acquisition_lock:
+            self.sampling.timebase, fs_actual = ps.find_timebase(fs_requested)
+            self.sampling.dt = 1/fs_actual
+            self.sampling.n_samples = int(self.nSamplesSpinBox.value()*1e3)
 
-        if self.dso.connected:
-            self.sampling.dt = ps.get_sample_interval(self.dso, self.sampling)
+            if self.dso.connected:
+                self.sampling.dt = ps.get_sample_interval(self.dso,
+                                                          self.sampling)
+            self.runstate.sampling_changed = True
 
         self.samplerateSpinBox.setValue(self.sampling.fs()/FREQUENCYSCALE)
-
-        self.runstate.sampling_changed = True
+        self.stop_recording()   # New file for new sampling settings
+        self.update_rf_filter()     # Filter is designed for sample rate
+        self.update_display()
         return 0
 
     def update_pulser(self):
@@ -274,7 +404,8 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
             self.axis['awg'].set_ylim(-vlim, vlim)
             self.graph['awgspec'].set_data(f/FREQUENCYSCALE, psd)
 
-            self.dso = ps.set_signal(self.dso, self.sampling, self.pulse)
+            with self.acquisition_lock:
+                self.dso = ps.set_signal(self.dso, self.sampling, self.pulse)
             for g in ['awg', 'awgspec']:
                 if self.pulse.on:
                     self.graph[g].set_linestyle("solid")
@@ -288,13 +419,34 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
 
     def update_rf_filter(self):
         """Read RF noise filter settings from GUI."""
-        self.rf_filter.sample_rate = self.sampling.fs()
+        self.rf_filter.fs = self.sampling.fs()
         self.rf_filter.type = self.filterComboBox.currentText()
         self.rf_filter.f_min = self.fminSpinBox.value()*FREQUENCYSCALE
         self.rf_filter.f_max = self.fmaxSpinBox.value()*FREQUENCYSCALE
         self.rf_filter.order = self.filterOrderSpinBox.value()
         return 0
 
+    def update_display_rate(self):
+        """Read max. display rate from GUI, frames per second.
+
+        Acquisition is not limited, traces acquired between two frames
+        are not displayed, but are recorded if recording is on.
+        """
+        fps = self.displayRateSpinBox.value()
+        self.display_timer.setInterval(round(1000/fps))
+        return 0
+
+    def update_average(self):
+        """Read number of traces in running average from GUI.
+
+        The average is updated in the acquisition thread, see
+        acquire_continuously()
+        """
+        with self.acquisition_lock:
+            self.running_average.n_average = self.averageSpinBox.value()
+            self.running_average.reset()
+        return 0
+
 # %% Acquire, display, and save results
 
     def control_acquisition(self):
@@ -306,42 +458,154 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
         return 0
 
     def acquire_trace(self):
-        """Acquire trace from instrument."""
+        """Start acquisition of traces from instrument.
+
+        Traces are acquired in a separate thread, see acquisition_loop(),
+        and put in a short queue. A timer in the GUI displays the latest
+        trace, so the instrument is not waiting for the display.
+        """
         if self.runstate.oscilloscope_ready:
             self.runstate.oscilloscope_ready = False
-            self.runstate_sampling_changed = True
+            self.runstate.stop_acquisition = False
+            self.runstate.sampling_changed = True
+            self.runstate.error = None
+            self.dso.abort.clear()
 
             self.saveButton.setEnabled(True)
+            self.recordButton.setEnabled(True)
             self.closeButton.setEnabled(False)
             self.transmitButton.setEnabled(self.dso.signal_generator)
 
             self.update_status_box("Acquiring", COLOR_OK)
             self.statusBar.showMessage("Acquiring data ...")
-            while not (self.runstate.stop_acquisition):
+            self.rates.reset()
+            self.acquisition_thread = threading.Thread(
+                                        target=self.acquisition_loop,
+                                        daemon=True)
+            self.acquisition_thread.start()
+            self.display_timer.start()  # Interval from display rate
+        return 0
+
+    def acquisition_loop(self):
+        """Acquire traces until stopped. Runs in separate thread.
+
+        Traces are kept as ADC counts and scaled at display time.
+        Traces are recorded to file if recording is on, and put in the
+        display queue. If the queue is full, the new trace is dropped.
+        Must not call Qt functions, as it runs outside the GUI thread.
+        Errors stop the acquisition, and are stored in runstate.error to
+        be reported by display_trace(). Errors after Stop are ignored, as
+        waiting for a trigger is aborted by stop_acquisition()
+        """
+        try:
+            self.acquire_continuously()
+        except Exception as error:     # Driver and instrument errors
+            if not self.runstate.stop_acquisition:
+                self.runstate.error = error
+            self.runstate.stop_acquisition = True
+        return 0
+
+    def acquire_continuously(self):
+        """Acquire traces until stopped, see acquisition_loop().
+
+        Every acquired trace is added to the running average, also traces
+        that are not displayed. The average is copied only for traces put
+        in the display queue, i.e., when the queue is not full
+        """
+        while not (self.runstate.stop_acquisition):
+            with self.acquisition_lock:
                 if self.runstate.sampling_changed:
                     self.dso = ps.configure_acquisition(self.dso,
                                                         self.sampling)
                     self.runstate.sampling_changed = False
-                self.dso, self.wfm.y = ps.acquire_trace(self.dso,
-                                                        self.sampling,
-                                                        self.channel)
-                self.wfm.dt = self.sampling.dt
-                self.wfm.t0 = self.sampling.t0()
-                self.plot_result()
-        self.update_status_box("Stopped", COLOR_WARNING)
-        self.statusBar.showMessage("Ready")
-        self.runstate.stop_acquisition = False
+                self.dso, y = ps.acquire_trace(self.dso,
+                                               self.sampling,
+                                               self.channel,
+                                               raw=True)
+                wfm = us.Waveform(y,
+                                  dt=self.sampling.dt,
+                                  t0=self.sampling.t0())
+                wfm.scale = ps.adc_scale(self.dso, self.channel)
+                if self.recorder is not None:   # Range may change, Volts
+                    self.recorder.append(wfm)
+                wfm_average = self.running_average.add(wfm)
+            self.rates.count("acquired")
+            self.rates.add_timing(self.dso.timing)
+
+            if self.trace_queue.full():     # Display busy, trace not copied
+                self.rates.count("dropped")
+                continue
+            if wfm_average is not wfm:      # Overwritten by next trace
+                wfm_average = us.Waveform(wfm_average.y.copy(),
+                                          dt=wfm_average.dt,
+                                          t0=wfm_average.t0)
+                wfm_average.dtr = wfm.dtr
+            self.trace_queue.put_nowait((wfm, wfm_average))
+        return 0
+
+    def display_trace(self):
+        """Display latest acquired trace, drop older traces in queue.
+
+        Called by timer at max. display rate. Shows running average of
+        all acquired traces if selected in GUI. Rates and timing are shown
+        in the status bar. Stops acquisition if the acquisition thread
+        failed
+        """
+        if self.runstate.error is not None:
+            error = self.runstate.error
+            self.runstate.error = None
+            self.acquireButton.setChecked(False)
+            self.stop_acquisition()
+            self.update_status_box("Error", COLOR_WARNING)
+            self.statusBar.showMessage(f"Acquisition stopped by error: "
+                                       f"{error}")
+            return -1
+
+        traces = None
+        n_traces = 0
+        while not self.trace_queue.empty():
+            traces = self.trace_queue.get_nowait()
+            n_traces += 1
+        if traces is not None:
+            self.wfm, self.wfm_average = traces
+            self.plot_result()
+            self.rates.count("displayed")
+            self.rates.count("dropped", n_traces-1)
+        if self.rates.update():
+            self.statusBar.showMessage(self.rates.summary())
         return 0
 
     def stop_acquisition(self):
-        """Stop acquisition of traces without closing instrument connection."""
+        """Stop acquisition of traces without closing instrument connection.
+
+        The instrument is stopped, so the acquisition thread does not wait
+        for a trigger. If the thread does not stop within STOP_TIMEOUT,
+        this is reported and acquisition stays on, Stop can be tried again
+        """
         if not (self.runstate.stop_acquisition):
             self.statusBar.showMessage("Stopping")
             self.update_status_box("Stopping", COLOR_WARNING)
         self.runstate.stop_acquisition = True
+        if self.acquisition_thread is not None:
+            ps.abort_wait(self.dso)     # Do not wait for trigger
+            self.acquisition_thread.join(timeout=STOP_TIMEOUT)
+            if self.acquisition_thread.is_alive():
+                self.acquireButton.setChecked(True)
+                self.update_status_box("Not responding", COLOR_WARNING)
+                self.statusBar.showMessage("Acquisition thread did not stop, "
+                                           "press Stop to try again")
+                return -1
+            self.acquisition_thread = None
+        self.display_timer.stop()
+        self.display_trace()    # Show last trace acquired
+
         self.runstate.oscilloscope_ready = True
+        self.stop_recording()
         self.closeButton.setEnabled(True)
         self.saveButton.setEnabled(False)
+        self.recordButton.setEnabled(False)
+        self.update_status_box("Stopped", COLOR_WARNING)
+        self.statusBar.showMessage("Ready")
         return 0
 
     def plot_result(self, time_unit="us"):
@@ -351,33 +615,49 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
         ---------
         time_unit   String  Unit to use for time trace, 's', 'ms', 'us'
         """
-        wfm_filtered = self.wfm.filtered(self.rf_filter)
-        wfm_zoomed = wfm_filtered.zoomed(self.display.t_lim)
-        f, psd = wfm_zoomed.powerspectrum(scale="dB", normalise="True")
+        changed = self.display.changed   # Display settings changed in GUI
+        if changed:
+            self.apply_display()
+
+        result = self.pipeline   # Filter, zoom and spectrum, reused arrays
+        result.process(self.wfm_average, self.display.t_lim)
+        t_processed = time.perf_counter()
+
+        # Full trace reduced to envelope, two points per pixel
+        t_trace, y_trace = us.decimate_minmax(result.t, result.y_filtered,
+                                              self.display.n_pixels)
         ch_no = 0
         for ch_name in ps.CH_NAMES:
             if self.display.channel[ch_no]:
-                self.graph[ch_name][0].set_data(wfm_filtered.t()/TIMESCALE,
-                                                wfm_filtered.y[:, ch_no])
-                self.graph[ch_name][1].set_data(wfm_zoomed.t()/TIMESCALE,
-                                                wfm_zoomed.y[:, ch_no])
-                self.graph[ch_name][2].set_data(f/FREQUENCYSCALE,
-                                                psd[:, ch_no])
+                self.graph[ch_name][0].set_data(t_trace, y_trace[:, ch_no])
+                self.graph[ch_name][1].set_data(result.t_zoom,
+                                                result.y_zoom[:, ch_no])
+                self.graph[ch_name][2].set_data(result.f,
+                                                result.psd[:, ch_no])
             else:
                 self.graph[ch_name][0].set_data([], [])  # Full trace
                 self.graph[ch_name][1].set_data([], [])  # Selected interval
                 self.graph[ch_name][2].set_data([], [])  # Power spectrum
             ch_no += 1
-        # self.fig.canvas.draw()            # --- TRY: Probably necessary
-        self.fig.canvas.flush_events()    # --- TRY: Probably unnecessary
-        self.update_display()
+        if changed:
+            self.renderer.redraw()    # New axes and markers
+        else:
+            self.renderer.update()    # Redraw traces only
+        self.rates.add_timing(result.timing)
+        self.rates.add_timing({"draw": time.perf_counter() - t_processed})
         return 0
 
     def save_result(self):
         """Save measured traces and parameters to binary file.
 
         The filename is generated automatically from a short descriptive
-        prefix, the date, and a counter.
+        prefix, the date, and a counter. Traces are saved in Volts as 4-byte
+        floats, the format read by the LabVIEW and Matlab programs. If
+        'Raw ADC' is selected, traces are saved as ADC counts with scale
+        factors, see us.Waveform.save(). Raw files need the Python reader.
+        The last acquired trace is saved. If averaging is on, the running
+        average shown on screen is saved in Volts to a second file, with
+        '_average' added to the name
         """
         self.statusBar.showMessage("Saving results ...")
 
@@ -385,13 +665,56 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
                                       ext='trc',
                                       resultdir='results')
 
-        self.wfm.save(resultfile.path)
+        if self.saveRawCheckBox.isChecked():
+            self.wfm.save(resultfile.path)             # ADC counts, if raw
+        else:
+            self.wfm.scaled().save(resultfile.path)    # Volts
+        if self.running_average.n_average > 1:
+            name, ext = os.path.splitext(resultfile.path)
+            self.wfm_average.save(f"{name}_average{ext}")
         self.filecounterSpinBox.setValue(resultfile.counter)
         self.resultfileEdit.setText(resultfile.name)
         self.resultpathEdit.setText(resultfile.path)
         self.statusBar.showMessage(f'Result saved to {resultfile}')
         return 0
 
+    def record_result(self):
+        """Start or stop continuous recording of traces to binary file.
+
+        All acquired traces are appended to one 'WaveformSeries' file, one
+        record per trace with its own start time. Read traces with
+        WaveformSeries.read(). The filename is generated as for
+        save_result, with extension 'wfs'.
+        """
+        if not self.recordButton.isChecked():
+            self.stop_recording()
+            return 0
+
+        resultfile = us.find_filename(prefix='us',
+                                      ext='wfs',
+                                      resultdir='results')
+
+        with self.acquisition_lock:
+            self.recorder = us.WaveformSeries(resultfile.path, mode='a')
+        self.filecounterSpinBox.setValue(resultfile.counter)
+        self.resultfileEdit.setText(resultfile.name)
+        self.resultpathEdit.setText(resultfile.path)
+        self.statusBar.showMessage(f'Recording to {resultfile.name}')
+        return 0
+
+    def stop_recording(self):
+        """Close file for continuous recording, if open."""
+        with self.acquisition_lock:
+            recorder = self.recorder
+            self.recorder = None
+        if recorder is not None:
+            recorder.close()
+            self.statusBar.showMessage(
+                f'{len(recorder.index)} traces recorded to '
+                f'{recorder.filename}')
+        self.recordButton.setChecked(False)
+        return 0
+
 # %% General GUI read and write
 
     def update_status(self, message, append=False):
@@ -498,20 +821,50 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
         return voltage_scale, unit
 
     def update_display(self, time_unit="us"):
-        """Update values and markers on screen.
+        """Read display settings from GUI when changed.
+
+        Settings are stored in self.display. During acquisition, the axes
+        and markers are updated with the next trace, see plot_result().
+        Several changes between two traces give only one full redraw.
 
         Arguments
         ---------
         time_unit   String  Unit to use on time axis, "s", "ms", "us"
         """
+        t_lim = us.find_limits([self.zoomStartSpinBox.value(),
+                                self.zoomEndSpinBox.value()],
+                               min_diff=0.1)
+        self.display.t_lim = t_lim*TIMESCALE
+        self.display.db_lim = us.find_limits([self.dbMinSpinBox.value(),
+                                              self.dbMaxSpinBox.value()])
+        self.display.f_lim = us.find_limits([self.zoomFminSpinBox.value(),
+                                             self.zoomFmaxSpinBox.value()],
+                                            min_diff=0.1)
+        for k in range(len(self.display.channel)):
+            self.display.channel[k] = not self.chButton[k].isChecked()
+            self.display.v_zoom[k] = us.read_scaled_value(
+                                self.displayrangeComboBox[k].currentText())
+        self.display.changed = True
+
+        if self.acquisition_thread is None:   # No traces coming, draw now
+            self.apply_display()
+            self.renderer.redraw()
+        return 0
+
+    def display_resized(self, event):
+        """Update number of pixels in full trace when window is resized."""
+        self.display.changed = True
+        return 0
+
+    def apply_display(self):
+        """Set axes and markers from display settings, without drawing."""
         # Full trace
         self.axis["trace"][0].set_xlim(self.sampling.t0()/TIMESCALE,
                                        self.sampling.t_max()/TIMESCALE)
+        self.display.n_pixels = int(self.axis["trace"][0].bbox.width)
 
         # Selected interval, 'zoom'
-        t_lim = us.find_limits([self.zoomStartSpinBox.value(),
-                                self.zoomEndSpinBox.value()],
-                               min_diff=0.1)
+        t_lim = self.display.t_lim/TIMESCALE
         for k in range(len(self.graph['marker'])):
             self.graph['marker'][k].set_data(np.full((2, 1),
                                              t_lim[k]),
@@ -521,29 +874,21 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
                                        t_lim[1]-t_lim[0],
                                        2*V_MAX)
         self.axis["zoom"][0].set_xlim(t_lim)
-        self.display.t_lim = t_lim*TIMESCALE
 
         # Vertical scale
-        db_lim = us.find_limits([self.dbMinSpinBox.value(),
-                                self.dbMaxSpinBox.value()])
         for k in range(len(self.display.channel)):
-            self.display.channel[k] = not self.chButton[k].isChecked()
-            vzoom = us.read_scaled_value(
-                                self.displayrangeComboBox[k].currentText())
+            vzoom = self.display.v_zoom[k]
             self.axis["zoom"][k].set_ylim(-vzoom, vzoom)
             self.axis["trace"][k].set_ylim(-self.channel[k].v_max(),
                                            self.channel[k].v_max())
-            self.axis["spectrum"][k].set_ylim(db_lim)
-        self.axis["awgspec"].set_ylim(db_lim)
+            self.axis["spectrum"][k].set_ylim(self.display.db_lim)
+        self.axis["awgspec"].set_ylim(self.display.db_lim)
 
         # Frequency axis
-        f_lim = us.find_limits([self.zoomFminSpinBox.value(),
-                               self.zoomFmaxSpinBox.value()],
-                               min_diff=0.1)
-        self.axis["spectrum"][0].set_xlim(f_lim)
-        self.axis["awgspec"].set_xlim(f_lim)
+        self.axis["spectrum"][0].set_xlim(self.display.f_lim)
+        self.axis["awgspec"].set_xlim(self.display.f_lim)
 
-        self.fig.canvas.draw()
+        self.display.changed = False
         return 0
 
 # %% Conect GUI to functions
@@ -566,6 +911,9 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
         self.fminSpinBox.valueChanged.connect(self.update_rf_filter)
         self.fmaxSpinBox.valueChanged.connect(self.update_rf_filter)
         self.filterOrderSpinBox.valueChanged.connect(self.update_rf_filter)
+        self.averageSpinBox.valueChanged.connect(self.update_average)
+        self.displayRateSpinBox.valueChanged.connect(
+                                                self.update_display_rate)
 
         # Oscilloscope vertical, 2 channels, A and B
         self.chButton = [self.chAButton, self.chBButton]
@@ -617,6 +965,7 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
         self.connectButton.clicked.connect(self.connect_dso)
         self.acquireButton.clicked.connect(self.control_acquisition)
         self.saveButton.clicked.connect(self.save_result)
+        self.recordButton.clicked.connect(self.record_result)
         self.closeButton.clicked.connect(self.close_connection)
 
         self.chButton = [self.chAButton, self.chBButton]
@@ -708,6 +1057,70 @@ class ReadUltrasound(QtWidgets.QMainWindow, oscilloscope_main_window):
         fig.show()
         return fig, axis, graph
 
+    def define_graphs_pyqtgraph(self):
+        """Initialise result graphs using pyqtgraph, for fast live display.
+
+        Same layout and handles as define_graphs(), see pyqtgraph_display
+
+        Outputs
+        -------
+        fig     Handle              Handle to result window
+        axis    List of handles     Handles to graphs (subplots) in figure
+        graph   List of handles     Handles to plots inside subplots
+        """
+        fig = pgd.Figure(title="Ultrasound traces")
+
+        # Figure layout, as define_graphs()
+        axis = {}
+        axis['trace'] = fig.add_axis(0, 0, colspan=4,
+                                     title='Acquired traces',
+                                     xlabel='Time [us]')
+        axis['awg'] = fig.add_axis(1, 0, title='Pulser',
+                                   xlabel='Time [us]',
+                                   ylabel='Voltage [V]',
+                                   facecolor=COLOR_AWG_BACKGROUND)
+        axis['zoom'] = fig.add_axis(1, 1, colspan=3,
+                                    title='Selected interval',
+                                    xlabel='Time [us]',
+                                    facecolor=COLOR_MARKER_PATCH)
+        axis['awgspec'] = fig.add_axis(2, 0, xlabel='Frequency [MHz]',
+                                       facecolor=COLOR_AWG_BACKGROUND)
+        axis['spectrum'] = fig.add_axis(2, 1, colspan=3,
+                                        xlabel='Frequency [MHz]',
+                                        facecolor=COLOR_MARKER_PATCH)
+
+        # Dual y-axis for two channels
+        for g in ['trace', 'zoom', 'spectrum']:
+            axis[g] = [axis[g], axis[g].twinx()]
+
+        ch_no = 0
+        for ch in ps.CH_NAMES:   # Label and color dual axis graphs
+            for g in ['trace', 'zoom']:
+                axis[g][ch_no].set_ylabel('Voltage [V]', COLOR_CH[ch_no])
+            axis['spectrum'][ch_no].set_ylabel('Power [dB re. max]',
+                                               COLOR_CH[ch_no])
+            ch_no += 1
+
+        # Graphs, updated with data during measurement
+        graph = {}
+        graph['patch'] = axis['trace'][0].add_rectangle(COLOR_MARKER_PATCH)
+        graph['marker'] = [axis['trace'][0].plot_line(COLOR_MARKER),
+                           axis['trace'][0].plot_line(COLOR_MARKER)]
+        graph['awg'] = axis['awg'].plot_line(COLOR_AWG)
+        graph['awgspec'] = axis['awgspec'].plot_line(COLOR_AWG)
+
+        # Two channels plots
+        ch_no = 0
+        for ch_name in ps.CH_NAMES:
+            graph_color = COLOR_CH[ch_no]
+            graph[ch_name] = [axis['trace'][ch_no].plot_line(graph_color),
+                              axis['zoom'][ch_no].plot_line(graph_color),
+                              axis['spectrum'][ch_no].plot_line(graph_color)]
+            ch_no += 1
+
+        fig.show()
+        return fig, axis, graph
+
 
 # %% Main function
 if __name__ == "__main__":
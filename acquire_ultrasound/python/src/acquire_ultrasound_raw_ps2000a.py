@@ -91,7 +91,7 @@ if dso.connected:
     print("Setting trigger")
     dso.status = ps.set_trigger(dso, trigger, channel, sampling)
     sampling.dt = ps.get_sample_interval(dso, sampling)
-    rf_filter.sample_rate = sampling.fs()
+    rf_filter.fs = sampling.fs()
 
     # Acquisition
     print("Setting up acquisition")
@@ -99,7 +99,7 @@ if dso.connected:
 
     dso.status = ps.set_trigger(dso, trigger, channel, sampling)
     sampling.dt = ps.get_sample_interval(dso, sampling)
-    rf_filter.sample_rate = sampling.fs()
+    rf_filter.fs = sampling.fs()
 
     dso = ps.configure_acquisition(dso, sampling)
 
@@ -0,0 +1,189 @@
+"""Benchmark acquisition and display pipeline, using simulated Picoscope.
+
+Runs the chain acquire -> filter and spectrum -> display -> save for a
+number of traces, and reports time per stage and traces per second.
+No instrument is needed, the Picoscope SDK is replaced by the simulator in
+picoscope_simulator.py. Display uses the non-interactive 'Agg' backend.
+
+Operation
+    Configure simulated Picoscope
+    Acquire traces in block mode and rapid block mode
+    Process, draw and save each trace, timing each stage
+    Acquire average of traces
+    Stream continuously, filtering block by block
+    Print summary
+
+Lars Hoff, USN, 2024
+"""
+
+# %% Libraries
+
+import os
+import time
+import tempfile
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+
+os.environ["PICOSCOPE_SIMULATOR"] = "1"   # Before wrappers are imported
+matplotlib.use("Agg")
+
+import ultrasound_utilities as us
+import picoscope_simulator as simulator
+import ps5000a_ultrasound_wrappers as ps
+
+# %% Benchmark settings
+
+N_TRACES = 200          # Number of traces in each run
+N_SAMPLES = 100000      # Samples per trace
+FS_REQUESTED = 100e6    # [S/s] Sample rate
+N_CAPTURES = 20         # Traces per run in rapid block mode
+FS_STREAMING = 20e6     # [S/s] Sample rate in streaming mode
+
+simulator.settings.noise = 2e-3       # [V] RMS noise
+simulator.settings.latency = 1e-3     # [s] USB round trip
+simulator.settings.prf = 5e3          # [Hz] Pulse repetition frequency
+simulator.settings.bandwidth = 200e6  # [bytes/s] Transfer rate
+
+
+# %% Functions
+
+def report(name, timing):
+    """Print mean time per stage and traces per second."""
+    total = sum(np.mean(t) for t in timing.values())
+    print(f"\n{name}: {1/total:.1f} traces/s")
+    for stage, t in timing.items():
+        print(f"  {stage:<10} {np.mean(t)*1e3:8.2f} ms   "
+              f"(median {np.median(t)*1e3:.2f} ms)")
+    return 0
+
+
+def run_pipeline(name, acquire):
+    """Acquire, process, draw and save N_TRACES traces, timing each stage.
+
+    Parameters
+    ----------
+    name : str
+        Name of run, for report
+    acquire : function
+        Returns next trace as Waveform
+    """
+    timing = {"acquire": [], "process": [], "display": [], "save": []}
+    pipeline = us.DisplayPipeline(rf_filter, time_scale=1e-6,
+                                  frequency_scale=1e6)
+    fig, ax = plt.subplots(2, 1)
+    line_trace, = ax[0].plot([], [])
+    line_spectrum, = ax[1].plot([], [])
+    resultfile = os.path.join(resultdir, f"{name}.wfm")
+    with us.WaveformWriter(resultfile, len(channel), dt=sampling.dt,
+                           t0=sampling.t0()) as recorder:
+        for k in range(N_TRACES):
+            t_start = time.perf_counter()
+            wfm = acquire()
+            t_acquired = time.perf_counter()
+            pipeline.process(wfm, [0, 20e-6])
+            t_processed = time.perf_counter()
+            line_trace.set_data(pipeline.t, pipeline.y_filtered[:, 0])
+            line_spectrum.set_data(pipeline.f, pipeline.psd[:, 0])
+            fig.canvas.draw()
+            t_displayed = time.perf_counter()
+            recorder.write(wfm.scaled().y)
+            t_saved = time.perf_counter()
+
+            timing["acquire"].append(t_acquired - t_start)
+            timing["process"].append(t_processed - t_acquired)
+            timing["display"].append(t_displayed - t_processed)
+            timing["save"].append(t_saved - t_displayed)
+    plt.close(fig)
+    report(name, timing)
+    return timing
+
+
+def acquire_block():
+    """Acquire one trace in block mode, as raw ADC counts."""
+    global dso
+    dso, y = ps.acquire_trace(dso, sampling, channel, raw=True)
+    wfm = us.Waveform(y, dt=sampling.dt, t0=sampling.t0())
+    wfm.scale = ps.adc_scale(dso, channel)
+    return wfm
+
+
+def acquire_rapid():
+    """Return next trace from rapid block capture, acquire when used up."""
+    global dso, captured
+    if not captured:
+        dso, counts = ps.acquire_rapid_block(dso, sampling)
+        captured = list(counts)
+    wfm = us.Waveform(captured.pop(0), dt=sampling.dt, t0=sampling.t0())
+    wfm.scale = ps.adc_scale(dso, channel)
+    return wfm
+
+
+# %% Configure simulated oscilloscope
+
+dso = ps.Communication()
+channel = [ps.Channel(0),
+           ps.Channel(1)]
+trigger = ps.Trigger()
+sampling = ps.Horizontal()
+rf_filter = us.WaveformFilter()
+captured = []
+
+dso = ps.open_adc(dso)
+for k in range(len(channel)):
+    channel[k].no = k
+    channel[k].v_range = 1.0
+    channel[k].v_range = channel[k].v_max()
+    dso.status = ps.set_vertical(dso, channel[k])
+    dso.status = ps.set_bwl(dso, channel[k])
+
+trigger.source = 'EXT'
+sampling.timebase, fs_actual = ps.find_timebase(FS_REQUESTED)
+sampling.n_samples = N_SAMPLES
+dso.status = ps.set_trigger(dso, trigger, channel, sampling)
+sampling.dt = ps.get_sample_interval(dso, sampling)
+
+rf_filter.type = 'BPF'
+rf_filter.f_min = 500e3
+rf_filter.f_max = 6e6
+rf_filter.fs = sampling.fs()
+
+# %% Run benchmarks
+
+print(f"Simulated Picoscope, {N_SAMPLES} samples, {len(channel)} channels, "
+      f"{N_TRACES} traces")
+with tempfile.TemporaryDirectory() as resultdir:
+    dso = ps.configure_acquisition(dso, sampling)
+    run_pipeline("block", acquire_block)
+
+    dso = ps.configure_rapid_block(dso, sampling, N_CAPTURES)
+    run_pipeline("rapid_block", acquire_rapid)
+
+    dso = ps.configure_acquisition(dso, sampling)
+    t_start = time.perf_counter()
+    dso, wfm_mean, wfm_var = ps.acquire_average(dso, sampling, channel,
+                                                N_TRACES)
+    t_average = time.perf_counter() - t_start
+    print(f"\naverage: {N_TRACES} traces in {t_average*1e3:.1f} ms, "
+          f"{N_TRACES/t_average:.1f} traces/s")
+
+    # Contiguous blocks, filter state is kept from one block to the next
+    sampling.dt = 1/FS_STREAMING
+    dso, sampling = ps.start_streaming(dso, sampling)
+    rf_filter.fs = sampling.fs()
+    stream_filter = us.StreamingFilter(rf_filter)
+    t_filter = []
+    t_start = time.perf_counter()
+    for counts in ps.stream_blocks(dso, sampling.n_samples, N_TRACES):
+        wfm = us.Waveform(counts, dt=sampling.dt)
+        wfm.scale = ps.adc_scale(dso, channel)
+        t_block = time.perf_counter()
+        stream_filter.filtered(wfm)
+        t_filter.append(time.perf_counter() - t_block)
+    t_streaming = time.perf_counter() - t_start
+    dso = ps.stop_streaming(dso)
+    print(f"\nstreaming: {N_TRACES} blocks in {t_streaming*1e3:.1f} ms, "
+          f"filter {np.mean(t_filter)*1e3:.2f} ms per block")
+
+dso.status = ps.stop_adc(dso)
+dso.status = ps.close_adc(dso)
@@ -0,0 +1,495 @@
+"""Simulated Picoscope, for testing and benchmarking without an instrument.
+
+Replaces the c-style functions from Picoscope SDK (picosdk) used by the
+wrappers in ps5000a_ultrasound_wrappers.py and ps2000a_ultrasound_wrappers.py.
+Function names, arguments and status codes follow the SDK, so the wrappers
+and the programs using them run unchanged.
+
+Traces are synthesised as echoes of a pulse, from the arbitrary waveform
+generator if it is set, else from Settings.pulse. Noise, latency from start
+of acquisition until data are ready, trigger rate and USB transfer rate are
+set in Settings.
+
+Usage
+    Set the environment variable PICOSCOPE_SIMULATOR=1 before the wrappers
+    are imported. Settings are changed in picoscope_simulator.settings
+
+Reference
+  PicoScope 5000 Series (A API) - Programmer's Guide. Pico Tecknology Ltd, 2018
+  PicoScope 2000 Series (A API) - Programmer's Guide. Pico Tecknology Ltd, 2022
+
+Lars Hoff, USN, 2024
+"""
+
+import time
+import ctypes
+import threading
+import numpy as np
+import ultrasound_utilities as us
+
+# Status codes, subset of those used by the SDK
+PICO_STATUS = {"PICO_OK": 0x00,
+               "PICO_INVALID_HANDLE": 0x0C,
+               "PICO_INVALID_PARAMETER": 0x0D,
+               "PICO_INVALID_TIMEBASE": 0x0E,
+               "PICO_INVALID_CHANNEL": 0x10,
+               "PICO_BUSY": 0x27,
+               "PICO_NO_SAMPLES_AVAILABLE": 0x25,
+               "PICO_POWER_SUPPLY_NOT_CONNECTED": 0x119,
+               "PICO_USB3_0_DEVICE_NON_USB3_0_PORT": 0x11E}
+
+RANGES_MV = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000,
+             50000]                  # [mV] Full scale of input ranges
+TIME_UNIT_SCALE = [1e-15, 1e-12, 1e-9, 1e-6, 1e-3, 1]   # FS, PS, ... S
+FS_MAX = 125e6                       # [S/s] Sample rate at timebase 3
+MEMORY_SAMPLES = 128*2**20           # Sample memory, shared by segments
+
+# Callbacks, c-style function pointers as in the SDK
+BlockReadyType = ctypes.CFUNCTYPE(None,
+                                  ctypes.c_int16,
+                                  ctypes.c_uint32,
+                                  ctypes.c_void_p)
+StreamingReadyType = ctypes.CFUNCTYPE(None,
+                                      ctypes.c_int16,
+                                      ctypes.c_int32,
+                                      ctypes.c_uint32,
+                                      ctypes.c_int16,
+                                      ctypes.c_uint32,
+                                      ctypes.c_int16,
+                                      ctypes.c_int16,
+                                      ctypes.c_void_p)
+
+
+# %% Classes
+
+class PicoSDKCtypesError(Exception):
+    """Status from simulated instrument is not PICO_OK, as in picosdk."""
+
+
+class Settings:
+    """Simulated signals and instrument performance.
+
+    Attributes
+    ----------
+    pulse : us.Pulse class
+        Transmitted pulse, used if the waveform generator is not set
+    echoes : List of tuple of float
+        Delay [s] and amplitude relative to pulse of each echo
+    noise : float
+        [V] RMS noise, added to all channels
+    latency : float
+        [s] Time from start of acquisition until data are ready,
+        in addition to capture time
+    prf : float
+        [Hz] Trigger rate, pulse repetition frequency
+    bandwidth : float
+        [bytes/s] Data transfer rate from instrument
+    max_adc : int
+        Maximum ADC value
+    seed : int
+        Seed for random noise, None for random start
+    """
+
+    pulse = us.Pulse()
+    pulse.envelope = "hann"
+    pulse.n_cycles = 3
+    pulse.a = 0.5
+    echoes = [(10e-6, 0.4), (20e-6, 0.2), (30e-6, 0.1)]
+    noise = 1e-3
+    latency = 1e-3
+    prf = 1e3
+    bandwidth = 200e6
+    max_adc = 32767
+    seed = None
+
+
+settings = Settings()
+
+
+class SimulatedPicoscope:
+    """Simulated instrument, SDK functions as methods.
+
+    SDK function names are found as attributes, e.g., ps5000aRunBlock
+    calls the method RunBlock. Arguments follow the SDK for the model,
+    values passed by reference are changed as in the SDK.
+
+    Attributes
+    ----------
+    model : str
+        Instrument model, "5000a" or "2000a"
+    channel : dictionary of dictionary
+        Settings for each channel: enabled, range
+    buffer : dictionary of 1D array of int16
+        Data buffers, key is channel number and memory segment
+    """
+
+    def __init__(self, model):
+        """Create instrument of given model, with SDK constants."""
+        self.model = model
+        prefix = f"PS{model.upper()}"
+        self.prefix = f"ps{model}"
+        self.PICO_STATUS = PICO_STATUS
+        self.BlockReadyType = BlockReadyType
+        self.StreamingReadyType = StreamingReadyType
+        ranges = {}
+        for k, range_mv in enumerate(RANGES_MV):
+            if range_mv < 1000:
+                ranges[f"{prefix}_{range_mv}MV"] = k
+            else:
+                ranges[f"{prefix}_{range_mv//1000}V"] = k
+        setattr(self, f"{prefix}_RANGE", ranges)
+        setattr(self, f"{prefix}_COUPLING", {f"{prefix}_AC": 0,
+                                             f"{prefix}_DC": 1})
+        channels = {f"{prefix}_CHANNEL_{name}": k
+                    for k, name in enumerate("ABCD")}
+        channels[f"{prefix}_EXTERNAL"] = 4
+        setattr(self, f"{prefix}_CHANNEL", channels)
+        setattr(self, f"{prefix}_TIME_UNITS",
+                {f"{prefix}_{unit}": k for k, unit
+                 in enumerate(["FS", "PS", "NS", "US", "MS", "S"])})
+        setattr(self, f"{prefix}_DEVICE_RESOLUTION",
+                {f"{prefix}_DR_{bits}BIT": k for k, bits
+                 in enumerate([8, 12, 14, 15, 16])})
+        self.reset()
+
+    def __getattr__(self, name):
+        """Find SDK function name, e.g., ps5000aRunBlock for RunBlock."""
+        if name.startswith(self.prefix):
+            return object.__getattribute__(self, name[len(self.prefix):])
+        raise AttributeError(f"Simulated Picoscope has no '{name}'")
+
+    def reset(self):
+        """Set instrument to power-on state."""
+        self.open = False
+        self.channel = {k: {"enabled": True, "range": 8} for k in range(4)}
+        self.trigger_delay = 0
+        self.buffer = {}
+        self.n_segments = 1
+        self.n_captures = 1
+        self.n_pretrigger = 0
+        self.n_samples = 0
+        self.dt = 1/FS_MAX
+        self.ready_time = 0
+        self.ready_timer = None
+        self.awg = None
+        self.awg_frequency = 1
+        self.stream_start = None
+        self.n_streamed = 0
+        self.traces = {}
+        self.rng = np.random.default_rng(settings.seed)
+        return 0
+
+    # %% Connection
+    def OpenUnit(self, handle, serial, *resolution):
+        """Open instrument, sets handle."""
+        self.reset()
+        self.open = True
+        handle._obj.value = 1
+        return PICO_STATUS["PICO_OK"]
+
+    def ChangePowerSource(self, handle, power_state):
+        """Change power source, no effect."""
+        return self.check(handle)
+
+    def MaximumValue(self, handle, value):
+        """Return maximum ADC value by reference."""
+        value._obj.value = settings.max_adc
+        return self.check(handle)
+
+    def Stop(self, handle):
+        """Stop acquisition, block or streaming."""
+        if self.ready_timer is not None:
+            self.ready_timer.cancel()
+        self.stream_start = None
+        return self.check(handle)
+
+    def CloseUnit(self, handle):
+        """Close instrument."""
+        status = self.Stop(handle)
+        self.open = False
+        return status
+
+    # %% Vertical, trigger and horizontal settings
+    def SetChannel(self, handle, ch_no, enabled, coupling, adc_range,
+                   offset):
+        """Set channel enabled and input range."""
+        if not 0 <= ch_no < 4:
+            return PICO_STATUS["PICO_INVALID_CHANNEL"]
+        self.channel[ch_no] = {"enabled": bool(enabled),
+                               "range": int(adc_range)}
+        self.traces = {}
+        return self.check(handle)
+
+    def SetBandwidthFilter(self, handle, ch_no, bwl):
+        """Set bandwidth limiter, no effect."""
+        return self.check(handle)
+
+    def SetSimpleTrigger(self, handle, enabled, source, threshold,
+                         direction, delay, autotrigger_ms):
+        """Set trigger, only the delay is used."""
+        self.trigger_delay = int(delay)
+        self.traces = {}
+        return self.check(handle)
+
+    def SetAutoTriggerMicroSeconds(self, handle, autotrigger_us):
+        """Set auto trigger, no effect."""
+        return self.check(handle)
+
+    def GetTimebase2(self, handle, timebase, n_samples, *args):
+        """Return sample interval [ns] and max. samples by reference.
+
+        Arguments after n_samples differ between models, the sample
+        interval is first and max. samples the second last.
+        """
+        if timebase < 3:
+            return PICO_STATUS["PICO_INVALID_TIMEBASE"]
+        args[0]._obj.value = timebase_interval(timebase)*1e9
+        args[-2]._obj.value = MEMORY_SAMPLES // self.n_segments
+        return self.check(handle)
+
+    def GetTriggerTimeOffset64(self, handle, trigger_time, time_units,
+                               segment_index):
+        """Return trigger time offset, always 0."""
+        trigger_time._obj.value = 0
+        return self.check(handle)
+
+    # %% Buffers and memory segments
+    def SetDataBuffer(self, handle, ch_no, buffer, n_samples,
+                      segment_index, downsample_mode):
+        """Register buffer for channel and memory segment."""
+        self.buffer[(ch_no, segment_index)] = as_array(buffer, n_samples)
+        return self.check(handle)
+
+    def MemorySegments(self, handle, n_segments, max_samples):
+        """Split memory in segments, returns samples per segment."""
+        self.n_segments = n_segments
+        max_samples._obj.value = MEMORY_SAMPLES // n_segments
+        return self.check(handle)
+
+    def SetNoOfCaptures(self, handle, n_captures):
+        """Set number of captures in rapid block mode."""
+        if n_captures > self.n_segments:
+            return PICO_STATUS["PICO_INVALID_PARAMETER"]
+        self.n_captures = n_captures
+        return self.check(handle)
+
+    # %% Block mode
+    def RunBlock(self, handle, n_pretrigger, n_posttrigger, timebase,
+                 *args):
+        """Start acquisition, data ready after capture time and latency.
+
+        Arguments after timebase differ between models, the callback is
+        the second last.
+        """
+        ready_callback = args[-2]
+        self.n_pretrigger = n_pretrigger
+        self.n_samples = n_pretrigger + n_posttrigger
+        self.dt = timebase_interval(timebase)
+        capture_time = max(self.n_samples*self.dt, 1/settings.prf)
+        t_ready = settings.latency + self.n_captures*capture_time
+        self.ready_time = time.perf_counter() + t_ready
+        if ready_callback is not None:
+            self.ready_timer = threading.Timer(
+                                    t_ready,
+                                    ready_callback,
+                                    args=(1, PICO_STATUS["PICO_OK"], None))
+            self.ready_timer.start()
+        return self.check(handle)
+
+    def IsReady(self, handle, ready):
+        """Return 1 by reference if acquisition is finished."""
+        ready._obj.value = int(time.perf_counter() >= self.ready_time)
+        return self.check(handle)
+
+    def GetValues(self, handle, start_index, n_samples, downsample_ratio,
+                  downsample_mode, segment_index, overflow):
+        """Transfer one trace to the registered buffers."""
+        n = min(n_samples._obj.value, self.n_samples-start_index)
+        n_bytes = self.fill_segment(segment_index, start_index, n)
+        time.sleep(n_bytes/settings.bandwidth)
+        n_samples._obj.value = n
+        overflow._obj.value = 0
+        return self.check(handle)
+
+    def GetValuesBulk(self, handle, n_samples, from_segment, to_segment,
+                      downsample_ratio, downsample_mode, overflow):
+        """Transfer traces from a range of segments, rapid block mode."""
+        n = min(n_samples._obj.value, self.n_samples)
+        n_bytes = 0
+        for segment_index in range(from_segment, to_segment+1):
+            n_bytes += self.fill_segment(segment_index, 0, n)
+        time.sleep(n_bytes/settings.bandwidth)
+        n_samples._obj.value = n
+        return self.check(handle)
+
+    # %% Streaming mode
+    def RunStreaming(self, handle, sample_interval, time_units,
+                     n_pretrigger, n_posttrigger, auto_stop,
+                     downsample_ratio, downsample_mode, overview_size):
+        """Start streaming, samples are generated in real time."""
+        self.dt = sample_interval._obj.value*TIME_UNIT_SCALE[time_units]
+        self.stream_start = time.perf_counter()
+        self.n_streamed = 0
+        return self.check(handle)
+
+    def GetStreamingLatestValues(self, handle, streaming_callback,
+                                 parameter):
+        """Deliver samples generated since last call to callback.
+
+        Samples are written to the registered buffers of segment 0, from
+        where the previous call stopped, wrapping at the end of buffer.
+        """
+        if self.stream_start is None:
+            return PICO_STATUS["PICO_INVALID_PARAMETER"]
+        n_buffer = len(self.buffer[(0, 0)])
+        n_elapsed = int((time.perf_counter()-self.stream_start)/self.dt)
+        start_index = self.n_streamed % n_buffer
+        n = min(n_elapsed-self.n_streamed, n_buffer-start_index)
+        if n <= 0:
+            return PICO_STATUS["PICO_BUSY"]
+        t = (self.n_streamed + np.arange(n))*self.dt % (1/settings.prf)
+        for (ch_no, segment_index), buffer in self.buffer.items():
+            if segment_index == 0:
+                y = self.signal(ch_no, t)
+                buffer[start_index:start_index+n] = self.to_counts(ch_no, y)
+        self.n_streamed += n
+        streaming_callback(1, n, start_index, 0, 0, 0, 0, parameter)
+        return self.check(handle)
+
+    # %% Signal generator
+    def SigGenArbitraryMinMaxValues(self, handle, min_value, max_value,
+                                    min_length, max_length):
+        """Return limits of waveform generator by reference."""
+        min_value._obj.value = -32768
+        max_value._obj.value = 32767
+        min_length._obj.value = 1
+        max_length._obj.value = 32768
+        return self.check(handle)
+
+    def SigGenFrequencyToPhase(self, handle, frequency, index_mode,
+                               buffer_length, phase):
+        """Convert waveform repetition frequency to phase increment."""
+        self.awg_frequency = frequency
+        length = value_of(buffer_length)
+        phase._obj.value = int(frequency*length*2**32/200e6)
+        return self.check(handle)
+
+    def SetSigGenArbitrary(self, handle, offset_voltage, pk_to_pk,
+                           start_phase, stop_phase, phase_increment,
+                           dwell_count, waveform, waveform_length, *args):
+        """Load waveform to generator. Transmitted pulse in simulation."""
+        n = value_of(waveform_length)
+        amplitude = value_of(pk_to_pk)*1e-6/2
+        y = as_array(waveform, n).astype(float)/32767*amplitude
+        dt = 1/(self.awg_frequency*n)
+        self.awg = (np.arange(n)*dt, y)
+        self.traces = {}
+        return self.check(handle)
+
+    # %% Simulation
+    def check(self, handle):
+        """Return status for instrument handle."""
+        if self.open and value_of(handle) == 1:
+            return PICO_STATUS["PICO_OK"]
+        return PICO_STATUS["PICO_INVALID_HANDLE"]
+
+    def pulse(self):
+        """Return time and samples of transmitted pulse."""
+        if self.awg is not None:
+            return self.awg
+        return settings.pulse.t(), settings.pulse.y()
+
+    def signal(self, ch_no, t):
+        """Return noise-free signal [V] at times t after trigger.
+
+        Channel A receives the echoes, channel B the transmitted pulse.
+        Other channels receive noise only.
+        """
+        t_pulse, y_pulse = self.pulse()
+        y = np.zeros(len(t))
+        match ch_no:
+            case 0:
+                echoes = settings.echoes
+            case 1:
+                echoes = [(0, 1)]
+            case _:
+                echoes = []
+        for delay, amplitude in echoes:
+            y += amplitude*np.interp(t-delay, t_pulse, y_pulse,
+                                     left=0, right=0)
+        return y
+
+    def to_counts(self, ch_no, y):
+        """Add noise and convert signal [V] to ADC counts for channel."""
+        if not self.channel[ch_no]["enabled"]:
+            return 0
+        v_range = RANGES_MV[self.channel[ch_no]["range"]]*1e-3
+        y = y + settings.noise*self.rng.standard_normal(len(y))
+        y *= settings.max_adc/v_range
+        np.rint(y, out=y)
+        np.clip(y, -settings.max_adc, settings.max_adc, out=y)
+        return y
+
+    def fill_segment(self, segment_index, start_index, n):
+        """Write synthesised trace to buffers of one segment.
+
+        Noise-free traces are cached, noise is new for every trace.
+        Returns number of bytes transferred.
+        """
+        n_bytes = 0
+        for ch_no in range(4):
+            buffer = self.buffer.get((ch_no, segment_index))
+            if buffer is None:
+                continue
+            key = (ch_no, self.n_samples, self.n_pretrigger, self.dt)
+            if key not in self.traces:
+                k = np.arange(self.n_samples)
+                t = (k - self.n_pretrigger + self.trigger_delay)*self.dt
+                self.traces[key] = self.signal(ch_no, t)
+            y = self.traces[key][start_index:start_index+n]
+            buffer[:n] = self.to_counts(ch_no, y)
+            n_bytes += 2*n
+        return n_bytes
+
+
+# %% Utility functions
+
+def assert_pico_ok(status):
+    """Raise exception if status is not PICO_OK, as in picosdk."""
+    if status != PICO_STATUS["PICO_OK"]:
+        raise PicoSDKCtypesError(f"PicoSDK returned '{status}'")
+
+
+def timebase_interval(timebase):
+    """Return sample interval [s] for timebase, see find_timebase()."""
+    return (timebase-2)/FS_MAX
+
+
+def value_of(x):
+    """Return Python value of c-type variable, or value itself."""
+    return getattr(x, "value", x)
+
+
+def as_array(buffer, n_samples):
+    """Return buffer passed to SDK as numpy array, without copying.
+
+    Arguments
+    ---------
+    buffer : ctypes pointer, byref() or ctypes array
+        Buffer as passed to the SDK
+    n_samples : int
+        Number of samples in buffer
+
+    Output
+    ------
+    x : 1D array
+        View of buffer
+    """
+    buffer = getattr(buffer, "_obj", buffer)    # Passed by byref()
+    if isinstance(buffer, ctypes.Array):
+        return np.ctypeslib.as_array(buffer)[:n_samples]
+    return np.ctypeslib.as_array(buffer, shape=(n_samples,))
+
+
+ps5000a = SimulatedPicoscope("5000a")
+ps2000a = SimulatedPicoscope("2000a")
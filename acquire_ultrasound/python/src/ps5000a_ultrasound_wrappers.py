@@ -11,6 +11,9 @@ Picoscope 5000a from any standard Pyton environment
 Based on example program from Picotech
   PS5000A BLOCK MODE EXAMPLE, # Copyright (C) 2018-2022 Pico Technology Ltd.
 
+Set the environment variable PICOSCOPE_SIMULATOR=1 to run without an
+instrument, using the simulated SDK functions in picoscope_simulator.py
+
 Reference
   PicoScope 5000 Series (A API) - Programmer's Guide. Pico Tecknology Ltd, 2018
 
@@ -18,15 +21,28 @@ Lars Hoff, USN, Sep 2022
 Modified June 2024 to better follow PEP-8 and numpy docstring style guides.
 """
 
+import os
 import time
 import ctypes
+import mmap
+import threading
 import numpy as np
-from picosdk.ps5000a import ps5000a as picoscope
-from picosdk.functions import adc2mV, assert_pico_ok
+import ultrasound_utilities as us   # Waveform class for results
+if os.environ.get("PICOSCOPE_SIMULATOR"):    # No instrument, see simulator
+    from picoscope_simulator import ps5000a as picoscope
+    from picoscope_simulator import assert_pico_ok
+else:
+    from picosdk.ps5000a import ps5000a as picoscope
+    from picosdk.functions import assert_pico_ok
 
 DAC_SAMPLERATE = 500e6   # [Samples/s] Fixed, see Programmer's guide
 DAC_MAX_AMPLITUDE = 2.0   # [v] Max. amplitude from signal generator
 CH_NAMES = ["A", "B"]
+READY_TIMEOUT = 1.0       # [s] Wait for callback, added to capture time
+POLL_MIN = 100e-6         # [s] Shortest and longest interval when polling
+POLL_MAX = 10e-3
+STREAM_RING_BLOCKS = 32   # Ring buffer length, in driver buffer lengths
+PAGE_SIZE = mmap.PAGESIZE  # [bytes] Alignment of data buffers
 
 
 # %% Classes
@@ -158,6 +174,8 @@ class Horizontal:
         Time of first sample point
     t_max : float
         Time of last sample point
+    duration : float
+        Duration of acquired trace
     """
 
     timebase = 3
@@ -189,6 +207,10 @@ class Horizontal:
         """
         return (self.n_samples - self.n_pretrigger() - 1) * self.dt
 
+    def duration(self):
+        """Return duration of acquired trace, i.e., capture time."""
+        return self.n_samples * self.dt
+
 
 class Communication:
     """c-type variables for calling c-style functions in DLLs from Pico SDK.
@@ -219,8 +241,11 @@ class Communication:
         Overflow detected in input data
     channel : str
         Channel name, 'A', 'B', ...
-    buffer : List of pointers
-        Buffer for acquired data ponts
+    buffer : DataBuffer class
+        Buffer for acquired data ponts, kept between acquisitions
+    registered : int
+        No. of samples per channel registered with driver, 0 if buffer
+        is not registered
     awg_max_value : ctypes.c_int16
         Max value for arbitrary waveform generator
     awg_min_value : ctypes.c_int16
@@ -229,6 +254,33 @@ class Communication:
         Min. no of points for arbitrary waveform generator
     awg_max_length : ctypes.c_int32
         Max. no of points for arbitrary waveform generator
+    wait_mode : str
+        Wait for acquisition by "callback" from driver, or "poll"
+    block_ready : threading.Event
+        Set by driver callback when acquisition is finished
+    abort : threading.Event
+        Set by abort_wait() to stop waiting for acquisition
+    ready_callback : BlockReadyType
+        Callback passed to driver, reference kept to avoid deletion
+    n_captures : int
+        Number of traces captured per run, more than 1 in rapid block mode
+    rapid_buffer : 3D array of int16
+        Buffer for rapid block mode, capture x channel x sample
+    overflow_bulk : ctypes.c_int16 array
+        Overflow detected in each capture, rapid block mode
+    stream : RingBuffer
+        Samples received in streaming mode, read by stream_blocks()
+    stream_buffer : 2D array of int16
+        Driver buffer for streaming mode, channel x sample
+    streaming_callback : StreamingReadyType
+        Callback passed to driver, reference kept to avoid deletion
+    streaming : threading.Event
+        Set while streaming, cleared to stop polling thread
+    stream_thread : threading.Thread
+        Thread polling the driver for new samples in streaming mode
+    timing : dictionary of float
+        Duration of last acquisition [s], "acquire" is wait for trigger
+        and capture, "transfer" is reading data from the instrument
     """
 
     handle = ctypes.c_int16(0)
@@ -240,11 +292,141 @@ class Communication:
     max_adc = ctypes.c_int16(0)
     overflow = ctypes.c_int16(0)
     channel = 'A'
-    buffer = []
+    buffer = None
+    registered = 0
     awg_max_value = ctypes.c_int16(0)
     awg_min_value = ctypes.c_int16(0)
     awg_min_length = ctypes.c_int32(0)
     awg_max_length = ctypes.c_int32(0)
+    wait_mode = "callback"
+    block_ready = None
+    abort = None
+    ready_callback = None
+    n_captures = 1
+    rapid_buffer = None
+    overflow_bulk = None
+    stream = None
+    stream_buffer = None
+    streaming_callback = None
+    streaming = None
+    stream_thread = None
+    timing = {"acquire": 0.0, "transfer": 0.0}
+
+
+class DataBuffer:
+    """Persistent buffers for acquired data, ADC counts for all channels.
+
+    Allocated once as one page-aligned array, and reused for all
+    acquisitions. Each channel starts on a new page. Memory is allocated
+    again only if a longer trace than the capacity is requested.
+
+    Attributes
+    ----------
+    data : 2D array of int16
+        Buffers for all channels, channel x sample
+
+    Methods
+    -------
+    n_max : int
+        Capacity, max. no. of samples per channel
+    pointer : ctypes pointer
+        Pointer to buffer for one channel, for driver
+    """
+
+    def __init__(self, n_channels, n_samples):
+        page_samples = PAGE_SIZE // np.dtype(np.int16).itemsize
+        n_max = -(-max(n_samples, 1) // page_samples) * page_samples
+        self.data = aligned_zeros((n_channels, n_max), np.int16)
+
+    def n_max(self):
+        """Return capacity, max. no. of samples per channel."""
+        return self.data.shape[1]
+
+    def pointer(self, ch_no):
+        """Return pointer to buffer for channel no. ch_no."""
+        buffer = self.data[ch_no].ctypes
+        return buffer.data_as(ctypes.POINTER(ctypes.c_int16))
+
+
+class RingBuffer:
+    """Ring buffer for samples streamed from the oscilloscope.
+
+    One thread writes, another reads. Positions are counted in samples
+    since start, and each counter is updated by one thread only, so no
+    lock is needed. The writer marks the samples it will write in
+    n_reserved before writing, and updates n_written after. The reader
+    checks n_reserved both before and after copying, so samples
+    overwritten during the copy are detected (seqlock).
+
+    Attributes
+    ----------
+    data : 2D array of int16
+        Stored samples, sample x channel
+    n_written : int
+        Total number of samples written
+    n_reserved : int
+        Total number of samples written or being written
+    n_read : int
+        Total number of samples read
+
+    Methods
+    -------
+    available : int
+        Number of samples written but not yet read
+    write(samples)
+        Add samples to buffer
+    read(n) : 2D array of int16
+        Remove n samples from buffer
+    """
+
+    def __init__(self, n_samples, n_channels):
+        self.data = np.zeros((n_samples, n_channels), dtype=np.int16)
+        self.n_written = 0
+        self.n_reserved = 0
+        self.n_read = 0
+
+    def available(self):
+        """Return number of samples written but not yet read."""
+        return self.n_written - self.n_read
+
+    def write(self, samples):
+        """Add samples to buffer, sample x channel.
+
+        If more samples than the buffer length are written at once, only
+        the newest are kept. The older are counted as written and lost,
+        so the reader reports an overrun.
+        """
+        n_ring = len(self.data)
+        n_total = len(samples)
+        n_skip = max(n_total - n_ring, 0)   # Overwritten at once
+        samples = samples[n_skip:]
+        n = len(samples)
+        self.n_reserved = self.n_written + n_total
+        start = (self.n_written + n_skip) % n_ring
+        n_first = min(n, n_ring-start)
+        self.data[start:start+n_first] = samples[:n_first]
+        self.data[:n-n_first] = samples[n_first:]
+        self.n_written = self.n_reserved
+
+    def read(self, n):
+        """Remove n samples from buffer, returns copy as sample x channel.
+
+        Raises BufferError if the writer has overwritten unread samples,
+        before or while they were copied.
+        """
+        n_ring = len(self.data)
+        if n > n_ring:
+            raise ValueError(f"Cannot read {n} samples from stream buffer "
+                             f"of {n_ring} samples")
+        if self.n_reserved - self.n_read > n_ring:
+            raise BufferError("Stream buffer overrun, samples lost")
+        start = self.n_read % n_ring
+        index = np.arange(start, start+n) % n_ring
+        block = self.data.take(index, axis=0)
+        if self.n_reserved - self.n_read > n_ring:   # Overwritten in copy
+            raise BufferError("Stream buffer overrun, samples lost")
+        self.n_read += n
+        return block
 
 
 # %%
@@ -268,6 +450,7 @@ def open_adc(dso):
                                 ctypes.byref(dso.handle), None, resolution)
     try:
         assert_pico_ok(dso.status["openunit"])
+        dso.connected = True
     except:  # PicoNotOkError:
         power_state = dso.status["openunit"]
         if power_state in [
@@ -280,17 +463,19 @@ def open_adc(dso):
             raise
 
         assert_pico_ok(dso.status["changePowerSource"])
-        dso.status["maximumValue"] = picoscope.ps5000aMaximumValue(
-                                                dso.handle,
-                                                ctypes.byref(dso.max_adc))
-        assert_pico_ok(dso.status["maximumValue"])
-        dso.connected = ((dso.status["changePowerSource"] == 0)
-                         and (dso.status["maximumValue"] == 0))
+        dso.connected = (dso.status["changePowerSource"] == 0)
+
+    dso.status["maximumValue"] = picoscope.ps5000aMaximumValue(
+                                            dso.handle,
+                                            ctypes.byref(dso.max_adc))
+    assert_pico_ok(dso.status["maximumValue"])
+    dso.connected = (dso.connected and (dso.status["maximumValue"] == 0))
+    dso.abort = threading.Event()
     return dso
 
 
 def stop_adc(dso):
-    """Stop oscilloscope. Only applicable when in streaming mode.
+    """Stop oscilloscope, ends streaming or block acquisition.
 
     Argument
     --------
@@ -516,7 +701,10 @@ def get_sample_interval(dso, sampling):
 def configure_acquisition(dso, sampling):
     """Configure acquisition of data from oscilloscope.
 
-    Configures oscilloscope and sets up buffers for input data
+    Configures oscilloscope and sets up buffers for input data.
+    Buffers are kept between calls, and registered with the driver again
+    only if the number of samples has changed.
+    Creates the callback used by the driver to signal finished acquisition
 
     Arguments
     ---------
@@ -530,31 +718,44 @@ def configure_acquisition(dso, sampling):
     dso : Communication class
         Communication status for instrument
     """
-    dso.max_samples.value = sampling.n_samples
+    if dso.ready_callback is None:
+        dso.block_ready = threading.Event()
+        dso.ready_callback = block_ready_callback(dso)
+    if dso.n_captures > 1:      # Return from rapid block mode
+        dso = set_captures(dso, 1)
+
+    n_samples = sampling.n_samples
+    dso.max_samples.value = n_samples
     segment_index = 0
     downsample_mode = 0
-    dso.buffer = []
-    dso.buffer.append((ctypes.c_int16*sampling.n_samples)())
-    dso.buffer.append((ctypes.c_int16*sampling.n_samples)())
-    status_prefix = "setDataBuffers"
-    ch_no = 0
-    for ch_name in CH_NAMES:
-        status_name = status_prefix+ch_name
-        dso.status[status_name] = picoscope.ps5000aSetDataBuffer(
-                                             dso.handle,
-                                             ch_no,
-                                             ctypes.byref(dso.buffer[ch_no]),
-                                             sampling.n_samples,
-                                             segment_index,
-                                             downsample_mode)
-        assert_pico_ok(dso.status[status_name])
-        ch_no += 1
+    if dso.buffer is None or dso.buffer.n_max() < n_samples:
+        dso.buffer = DataBuffer(len(CH_NAMES), n_samples)
+        dso.registered = 0
+
+    if dso.registered != n_samples:     # Register only if changed
+        status_prefix = "setDataBuffers"
+        ch_no = 0
+        for ch_name in CH_NAMES:
+            status_name = status_prefix+ch_name
+            dso.status[status_name] = picoscope.ps5000aSetDataBuffer(
+                                                dso.handle,
+                                                ch_no,
+                                                dso.buffer.pointer(ch_no),
+                                                n_samples,
+                                                segment_index,
+                                                downsample_mode)
+            assert_pico_ok(dso.status[status_name])
+            ch_no += 1
+        dso.registered = n_samples
     return dso
 
 
-def acquire_trace(dso, sampling, ch):
+def acquire_trace(dso, sampling, ch, raw=False):
     """Acuire voltage trace from oscilloscope.
 
+    The trace is returned as raw ADC counts if raw is True, to be scaled
+    later, e.g., at display time. Scale with adc_scale()
+
     Arguments
     ---------
     dso : Communication class
@@ -563,18 +764,224 @@ def acquire_trace(dso, sampling, ch):
         Names of channels to acquire
     sampling : Horizontal class
         Settings for oscilloscope horizontal scale
+    raw : bool
+        Return ADC counts instead of Volts
 
     Output
     ------
     dso.status : dictionary of str
           Status message for operation
-    v  : 2D array of float
-        Acquired traces, scaled in Volts
+    v  : 2D array of float, or int16 if raw
+        Acquired traces, scaled in Volts or as ADC counts
+    """
+    dso = acquire_block(dso, sampling)
+
+    # Convert ADC counts data to Volts, one multiplication per channel
+    n_channels = len(ch)
+    counts = adc_counts(dso, n_channels)
+    if raw:
+        return dso, counts.T.copy()
+    scale = adc_scale(dso, ch)
+    v = np.empty([sampling.n_samples, n_channels])
+    for ch_no in range(n_channels):
+        np.multiply(counts[ch_no], scale[ch_no], out=v[:, ch_no])
+    return dso, v
+
+
+def acquire_block(dso, sampling):
+    """Acquire one trace as ADC counts, to the buffers in dso.buffer.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    sampling : Horizontal class
+        Settings for oscilloscope horizontal scale
+
+    Output
+    ------
+    dso : Communication class
+        Communication status for instrument
     """
     start_index = 0
     downsample_ratio = 0
     downsample_mode = 0
     segment_index = 0
+    t_start = time.perf_counter()
+    dso = run_block(dso, sampling)
+
+    # Wait for data collection to finish
+    dso = wait_for_block(dso, sampling)
+    t_captured = time.perf_counter()
+
+    # Transfer data values
+    dso.status["getValues"] = picoscope.ps5000aGetValues(
+                                         dso.handle,
+                                         start_index,
+                                         ctypes.byref(dso.max_samples),
+                                         downsample_ratio,
+                                         downsample_mode,
+                                         segment_index,
+                                         ctypes.byref(dso.overflow))
+    assert_pico_ok(dso.status["getValues"])
+    dso.timing = {"acquire": t_captured - t_start,
+                  "transfer": time.perf_counter() - t_captured}
+    return dso
+
+
+def acquire_average(dso, sampling, ch, n_average, variance=False):
+    """Acquire n_average traces and return average as Waveform, in Volts.
+
+    Traces are added as ADC counts to an integer accumulator in place,
+    no arrays are allocated per trace. Uses rapid block mode if it is
+    configured, see configure_rapid_block(), else one block per trace.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    sampling : Horizontal class
+        Settings for oscilloscope horizontal scale
+    ch : List of Channel class
+        Vertical settings of channels to acquire
+    n_average : int
+        Number of traces to average
+    variance : bool
+        Calculate variance of traces also
+
+    Output
+    ------
+    dso : Communication class
+        Communication status for instrument
+    wfm_mean : us.Waveform class
+        [V] Average of traces
+    wfm_var : us.Waveform class
+        [V^2] Variance of traces, None if variance is False
+    """
+    n_channels = len(ch)
+    n_samples = sampling.n_samples
+    if n_average * 2**15 < 2**31:      # Sum of int16 fits in int32
+        total = np.zeros((n_channels, n_samples), dtype=np.int32)
+    else:
+        total = np.zeros((n_channels, n_samples), dtype=np.int64)
+    if variance:
+        total_square = np.zeros((n_channels, n_samples), dtype=np.int64)
+        square = np.empty((n_channels, n_samples), dtype=np.int64)
+
+    n_acquired = 0
+    while n_acquired < n_average:
+        if dso.n_captures > 1:
+            dso, counts = acquire_rapid_block(dso, sampling)
+            n_used = min(dso.n_captures, n_average-n_acquired)
+            traces = dso.rapid_buffer[:n_used, :n_channels]
+        else:
+            dso = acquire_block(dso, sampling)
+            traces = [adc_counts(dso, n_channels)]
+        for trace in traces:
+            np.add(total, trace, out=total)
+            if variance:
+                np.multiply(trace, trace, out=square, dtype=np.int64)
+                np.add(total_square, square, out=total_square)
+        n_acquired += len(traces)
+
+    scale = adc_scale(dso, ch)[:n_channels, np.newaxis]
+    mean = total/n_average
+    wfm_mean = us.Waveform((mean*scale).T, dt=sampling.dt, t0=sampling.t0())
+    wfm_var = None
+    if variance:
+        n_dof = max(n_average-1, 1)
+        var = (total_square - total*mean)/n_dof
+        wfm_var = us.Waveform((var*scale**2).T, dt=sampling.dt,
+                              t0=sampling.t0())
+    return dso, wfm_mean, wfm_var
+
+
+def adc_counts(dso, n_channels):
+    """Return data buffers as arrays of ADC counts, without copying.
+
+    The arrays are views of the buffers registered with the driver, and
+    are overwritten by the next acquisition.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    n_channels : int
+        Number of channels to return
+
+    Output
+    ------
+    counts : 2D array of int16
+        ADC counts, channel x sample
+    """
+    return dso.buffer.data[:n_channels, :dso.registered]
+
+
+def adc_scale(dso, ch):
+    """Return scale factors from ADC counts to Volts, for each channel.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    ch : List of Channel class
+        Vertical settings of channels
+
+    Output
+    ------
+    scale : 1D array of float
+        [V] Voltage of one ADC count, for each channel
+    """
+    return np.array([channel.v_max() for channel in ch])/dso.max_adc.value
+
+
+def aligned_zeros(shape, dtype, alignment=PAGE_SIZE):
+    """Allocate array of zeros, with start aligned to memory page.
+
+    Arguments
+    ---------
+    shape : tuple of int
+        Shape of array
+    dtype : numpy dtype
+        Data type of array
+    alignment : int
+        [bytes] Alignment of first element
+
+    Output
+    ------
+    x : array of dtype
+        Array of zeros, c-order
+    """
+    n_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    raw = np.zeros(n_bytes + alignment, dtype=np.uint8)
+    start = -raw.ctypes.data % alignment
+    return raw[start:start+n_bytes].view(dtype).reshape(shape)
+
+
+def run_block(dso, sampling):
+    """Start acquisition in block mode, returns without waiting.
+
+    Captures one trace, or dso.n_captures traces in rapid block mode.
+    The driver callback is used if dso.wait_mode is "callback"
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    sampling : Horizontal class
+        Settings for oscilloscope horizontal scale
+
+    Output
+    ------
+    dso : Communication class
+        Communication status for instrument
+    """
+    segment_index = 0
+    if dso.wait_mode == "callback":
+        dso.block_ready.clear()
+        ready_callback = dso.ready_callback
+    else:
+        ready_callback = None
     dso.status["runBlock"] = picoscope.ps5000aRunBlock(
                                     dso.handle,
                                     sampling.n_pretrigger(),
@@ -582,39 +989,394 @@ def acquire_trace(dso, sampling, ch):
                                     sampling.timebase,
                                     None,
                                     segment_index,
-                                    None,
+                                    ready_callback,
                                     None)
     assert_pico_ok(dso.status["runBlock"])
+    return dso
+
+
+def set_captures(dso, n_captures):
+    """Split instrument memory in segments, one capture per segment.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    n_captures : int
+        Number of traces to capture per run, 1 for normal block mode
+
+    Output
+    ------
+    dso : Communication class
+        Communication status for instrument
+    """
+    max_samples_segment = ctypes.c_int32(0)
+    dso.status["memorySegments"] = picoscope.ps5000aMemorySegments(
+                                        dso.handle,
+                                        n_captures,
+                                        ctypes.byref(max_samples_segment))
+    assert_pico_ok(dso.status["memorySegments"])
+    dso.status["setNoOfCaptures"] = picoscope.ps5000aSetNoOfCaptures(
+                                        dso.handle,
+                                        n_captures)
+    assert_pico_ok(dso.status["setNoOfCaptures"])
+    dso.n_captures = n_captures
+    return dso
+
+
+def configure_rapid_block(dso, sampling, n_captures):
+    """Configure rapid block mode, many traces captured in one run.
+
+    Instrument memory is split in n_captures segments, and one trace is
+    captured in each segment for consecutive triggers. Buffers for all
+    segments are allocated once, as one array, and registered with the
+    driver. Call configure_acquisition() to return to normal block mode.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    sampling : Horizontal class
+        Oscilloscope horizontal settings
+    n_captures : int
+        Number of traces to capture per run
+
+    Output
+    ------
+    dso : Communication class
+        Communication status for instrument
+    """
+    if dso.ready_callback is None:
+        dso.block_ready = threading.Event()
+        dso.ready_callback = block_ready_callback(dso)
+    dso = set_captures(dso, n_captures)
+
+    n_samples = sampling.n_samples
+    downsample_mode = 0
+    dso.rapid_buffer = np.zeros((n_captures, len(CH_NAMES), n_samples),
+                                dtype=np.int16)
+    dso.overflow_bulk = (ctypes.c_int16*n_captures)()
+    dso.registered = 0
+    for segment_index in range(n_captures):
+        for ch_no in range(len(CH_NAMES)):
+            buffer = dso.rapid_buffer[segment_index, ch_no].ctypes
+            status = picoscope.ps5000aSetDataBuffer(
+                            dso.handle,
+                            ch_no,
+                            buffer.data_as(ctypes.POINTER(ctypes.c_int16)),
+                            n_samples,
+                            segment_index,
+                            downsample_mode)
+            assert_pico_ok(status)
+    dso.status["setDataBuffersBulk"] = status
+    return dso
+
+
+def acquire_rapid_block(dso, sampling):
+    """Acquire dso.n_captures traces in rapid block mode.
+
+    All traces are captured in one run and transferred in one bulk call.
+    The data are returned as raw ADC counts, without scaling to Volts.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    sampling : Horizontal class
+        Settings for oscilloscope horizontal scale
+
+    Output
+    ------
+    dso : Communication class
+        Communication status for instrument
+    counts : 3D array of int16
+        Acquired traces as capture x sample x channel, ADC counts.
+        View of dso.rapid_buffer, overwritten by next acquisition.
+        Scale to Volts with adc_scale()
+    """
+    n_captures = dso.n_captures
+    downsample_ratio = 0
+    downsample_mode = 0
+    dso = run_block(dso, sampling)
+    dso = wait_for_block(dso, sampling, n_captures)
+
+    n_samples = ctypes.c_uint32(sampling.n_samples)
+    dso.status["getValuesBulk"] = picoscope.ps5000aGetValuesBulk(
+                                        dso.handle,
+                                        ctypes.byref(n_samples),
+                                        0,
+                                        n_captures-1,
+                                        downsample_ratio,
+                                        downsample_mode,
+                                        ctypes.byref(dso.overflow_bulk))
+    assert_pico_ok(dso.status["getValuesBulk"])
+
+    counts = dso.rapid_buffer.transpose(0, 2, 1)
+    return dso, counts
+
+
+def start_streaming(dso, sampling):
+    """Start continuous acquisition in streaming mode.
+
+    Samples are transferred to a driver buffer of sampling.n_samples
+    samples per channel, and copied by the driver callback to the ring
+    buffer dso.stream. A background thread polls the driver for new
+    samples. Read data with stream_blocks(), stop with stop_streaming().
+    No trigger is used, recording starts immediately.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    sampling : Horizontal class
+        Oscilloscope horizontal settings. sampling.dt is the requested
+        sample interval, updated to the interval used by the instrument
+
+    Output
+    ------
+    dso : Communication class
+        Communication status for instrument
+    sampling : Horizontal class
+        Oscilloscope horizontal settings
+    """
+    n_driver = sampling.n_samples
+    n_channels = len(CH_NAMES)
+    segment_index = 0
+    downsample_ratio = 1
+    downsample_mode = 0
+    auto_stop = 0
+    dso.stream_buffer = np.zeros((n_channels, n_driver), dtype=np.int16)
+    dso.stream = RingBuffer(STREAM_RING_BLOCKS*n_driver, n_channels)
+    dso.streaming_callback = streaming_ready_callback(dso)
+    dso.registered = 0
+    for ch_no in range(n_channels):
+        buffer = dso.stream_buffer[ch_no].ctypes
+        status = picoscope.ps5000aSetDataBuffer(
+                            dso.handle,
+                            ch_no,
+                            buffer.data_as(ctypes.POINTER(ctypes.c_int16)),
+                            n_driver,
+                            segment_index,
+                            downsample_mode)
+        assert_pico_ok(status)
+    dso.status["setDataBuffersStreaming"] = status
+
+    sample_interval = ctypes.c_uint32(max(round(sampling.dt*1e9), 1))
+    time_units = picoscope.PS5000A_TIME_UNITS["PS5000A_NS"]
+    dso.status["runStreaming"] = picoscope.ps5000aRunStreaming(
+                                        dso.handle,
+                                        ctypes.byref(sample_interval),
+                                        time_units,
+                                        0,
+                                        n_driver,
+                                        auto_stop,
+                                        downsample_ratio,
+                                        downsample_mode,
+                                        n_driver)
+    assert_pico_ok(dso.status["runStreaming"])
+    sampling.dt = sample_interval.value*1e-9
+
+    poll_interval = min(max(sampling.duration()/4, POLL_MIN), POLL_MAX)
+    dso.streaming = threading.Event()
+    dso.streaming.set()
+    dso.stream_thread = threading.Thread(target=poll_streaming,
+                                         args=(dso, poll_interval),
+                                         daemon=True)
+    dso.stream_thread.start()
+    return dso, sampling
+
+
+def poll_streaming(dso, poll_interval):
+    """Poll driver for new samples while streaming, runs in own thread.
 
-    # Check for data collection to finish
-    # Primitive polling, consider replacing ps5000aIsReady
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    poll_interval : float
+        Time between calls to the driver [s]
+    """
+    busy = picoscope.PICO_STATUS["PICO_BUSY"]
+    while dso.streaming.is_set():
+        status = picoscope.ps5000aGetStreamingLatestValues(
+                                        dso.handle,
+                                        dso.streaming_callback,
+                                        None)
+        if status not in (0, busy):
+            dso.status["getStreamingLatestValues"] = status
+            dso.streaming.clear()
+            break
+        time.sleep(poll_interval)
+
+
+def stream_blocks(dso, n_block, n_blocks=None):
+    """Read streamed samples in blocks of fixed length.
+
+    Consecutive blocks contain consecutive samples, without gaps.
+    Waits for new samples if the ring buffer contains less than a block.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument, streaming started
+    n_block : int
+        Number of samples per block
+    n_blocks : int or None
+        Number of blocks to read. Continues until streaming stops if None
+
+    Yields
+    ------
+    counts : 2D array of int16
+        Samples as sample x channel, ADC counts
+    """
+    k = 0
+    while n_blocks is None or k < n_blocks:
+        while dso.stream.available() < n_block:
+            if not dso.streaming.is_set():
+                assert_pico_ok(dso.status.get("getStreamingLatestValues", 0))
+                return
+            time.sleep(POLL_MIN)
+        yield dso.stream.read(n_block)
+        k += 1
+
+
+def stop_streaming(dso):
+    """Stop streaming mode acquisition and polling thread.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+
+    Output
+    ------
+    dso : Communication class
+        Communication status for instrument
+    """
+    if dso.streaming is not None:
+        dso.streaming.clear()
+        dso.stream_thread.join()
+    dso.status = stop_adc(dso)
+    return dso
+
+
+def streaming_ready_callback(dso):
+    """Create callback for driver to deliver new samples in streaming mode.
+
+    Copies the new samples from the driver buffer to the ring buffer.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+
+    Output
+    ------
+    streaming_callback : StreamingReadyType
+        c-style function pointer, called by GetStreamingLatestValues
+    """
+    def streaming_ready(handle, n_samples, start_index, overflow,
+                        trigger_at, triggered, auto_stop, parameter):
+        if n_samples > 0:
+            samples = dso.stream_buffer[:, start_index:start_index+n_samples]
+            dso.stream.write(samples.T)
+        if overflow:
+            dso.status["streamingOverflow"] = overflow
+
+    return picoscope.StreamingReadyType(streaming_ready)
+
+
+def block_ready_callback(dso):
+    """Create callback for driver to signal that acquisition is finished.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+
+    Output
+    ------
+    ready_callback : BlockReadyType
+        c-style function pointer, sets dso.block_ready when called
+    """
+    def block_ready(handle, status, parameter):
+        dso.status["blockReady"] = status
+        dso.block_ready.set()
+
+    return picoscope.BlockReadyType(block_ready)
+
+
+def wait_for_block(dso, sampling, n_captures=1):
+    """Wait for block acquisition to finish.
+
+    In "callback" mode, waits for dso.block_ready to be set by the driver.
+    Falls back to polling if the callback does not arrive within the
+    capture time plus READY_TIMEOUT.
+    In "poll" mode, the instrument is polled with an interval scaled to
+    the expected capture time, between POLL_MIN and POLL_MAX.
+    Polling stops with an error if the driver does not return PICO_OK,
+    e.g., if the instrument is disconnected.
+    Waiting is stopped from another thread by abort_wait(), this
+    raises InterruptedError.
+
+    Arguments
+    ---------
+    dso : Communication class
+        Communication status for instrument
+    sampling : Horizontal class
+        Settings for oscilloscope horizontal scale
+    n_captures : int
+        Number of traces captured, rapid block mode
+
+    Output
+    ------
+    dso : Communication class
+        Communication status for instrument
+    """
+    t_capture = n_captures*sampling.duration()
+    if dso.wait_mode == "callback":
+        ready = dso.block_ready.wait(timeout=t_capture+READY_TIMEOUT)
+        if ready and not dso.abort.is_set():
+            return dso
+
+    poll_interval = min(max(t_capture/4, POLL_MIN), POLL_MAX)
     dso.acqusition_ready.value = 0
     while dso.acqusition_ready.value == 0:
+        if dso.abort.is_set():
+            raise InterruptedError("Acquisition aborted, no trace")
         dso.status["isReady"] = picoscope.ps5000aIsReady(
                                         dso.handle,
                                         ctypes.byref(dso.acqusition_ready))
-        time.sleep(0.01)
+        assert_pico_ok(dso.status["isReady"])
+        if dso.acqusition_ready.value == 0:
+            time.sleep(poll_interval)
+    return dso
 
-    # Transfer data values
-    dso.status["getValues"] = picoscope.ps5000aGetValues(
-                                         dso.handle,
-                                         start_index,
-                                         ctypes.byref(dso.max_samples),
-                                         downsample_ratio,
-                                         downsample_mode,
-                                         segment_index,
-                                         ctypes.byref(dso.overflow))
-    assert_pico_ok(dso.status["getValues"])
 
-    # Convert ADC counts data to Volts
-    n_channels = len(ch)
-    v_mv = np.zeros([sampling.n_samples, n_channels])
-    for ch_no in range(n_channels):
-        v_mv[:, ch_no] = adc2mV(dso.buffer[ch_no],
-                                ch[ch_no].adc_range(),
-                                dso.max_adc)
-    v = 1e-3*v_mv  # np.column_stack([mv_a, mv_b])
-    return dso, v
+def abort_wait(dso):
+    """Stop block acquisition from another thread, e.g., the GUI.
+
+    Sets dso.abort and stops the instrument, so a thread waiting in
+    wait_for_block() returns without waiting for a trigger. The waiting
+    thread raises InterruptedError. Clear dso.abort before starting a
+    new acquisition. The stop status is stored, not checked, as the
+    acquisition may already have finished
+
+    Argument
+    --------
+    dso : Communication class
+        Communication status for instrument
+
+    Output
+    ------
+    dso.status : dictionary of str
+        Status messages for instrument
+    """
+    dso.abort.set()
+    if dso.block_ready is not None:
+        dso.block_ready.set()   # Wake thread waiting for callback
+    dso.status["stop"] = picoscope.ps5000aStop(dso.handle)
+    return dso.status
 
 
 def check_awg(dso):
@@ -0,0 +1,305 @@
+"""Live display of traces using pyqtgraph, alternative to matplotlib.
+
+pyqtgraph draws through Qt, and can use OpenGL. Long traces are updated
+much faster than with matplotlib, suited for live display at tens of
+frames per second. Software rendering is used if OpenGL is not available.
+
+The classes wrap pyqtgraph objects with the subset of the matplotlib
+interface used by acquire_ultrasound.py: Axes are set with set_xlim() and
+set_ylim(), lines with set_data() and set_linestyle(), and the zoomed
+area with set_bounds(). The graph and axis dictionaries in the program
+can then hold objects from either library. matplotlib is still used for
+static figures and export.
+
+Usage
+    fig = Figure(title="Ultrasound")
+    ax = fig.add_axis(0, 0, colspan=4, title="Acquired traces")
+    line = ax.plot_line(color="tab:blue")
+    line.set_data(t, v)
+    renderer = Renderer(fig)
+
+Lars Hoff, USN, 2024
+"""
+
+from collections import namedtuple
+import numpy as np
+import matplotlib.colors as mcolors
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore, QtWidgets
+
+Bbox = namedtuple("Bbox", ["width", "height"])   # As matplotlib Bbox
+
+LINE_STYLES = {"solid": QtCore.Qt.PenStyle.SolidLine,
+               "dotted": QtCore.Qt.PenStyle.DotLine,
+               "dashed": QtCore.Qt.PenStyle.DashLine}
+
+
+# %% Classes
+
+class Figure:
+    """Window with graphs in a grid, as matplotlib Figure.
+
+    Attributes
+    ----------
+    widget : pyqtgraph.GraphicsLayoutWidget
+        Window containing the graphs
+    """
+
+    def __init__(self, title="", size=(1600, 1200), background="w",
+                 use_opengl=False):
+        """Create window.
+
+        Parameters
+        ----------
+        title : str
+            Window title
+        size : tuple of int
+            Window size, pixels
+        background : str
+            Background colour
+        use_opengl : bool
+            Draw with OpenGL, if available
+        """
+        pg.setConfigOptions(antialias=False, useOpenGL=use_opengl,
+                            foreground="k")
+        self.widget = pg.GraphicsLayoutWidget(title=title)
+        self.widget.setBackground(background)
+        self.widget.resize(*size)
+
+    def add_axis(self, row, col, rowspan=1, colspan=1, title="",
+                 xlabel="", ylabel="", facecolor=None):
+        """Add graph at position in grid.
+
+        Parameters
+        ----------
+        row, col : int
+            Position in grid
+        rowspan, colspan : int
+            Number of rows and columns covered
+        title, xlabel, ylabel : str
+            Graph title and axis labels
+        facecolor : str
+            Graph background colour, matplotlib colour name
+
+        Returns
+        -------
+        axis : Axis class
+            New graph
+        """
+        plot = self.widget.addPlot(row=row, col=col, rowspan=rowspan,
+                                   colspan=colspan)
+        plot.setTitle(title, justify="left")
+        plot.setLabel("bottom", xlabel)
+        plot.setLabel("left", ylabel)
+        plot.showGrid(x=True, y=True, alpha=0.3)
+        plot.setMenuEnabled(False)
+        if facecolor is not None:
+            plot.vb.setBackgroundColor(mcolors.to_hex(facecolor))
+        return Axis(plot, plot.vb)
+
+    def show(self):
+        """Show window."""
+        self.widget.show()
+        return 0
+
+    def close(self):
+        """Close window."""
+        self.widget.close()
+        return 0
+
+
+class Axis:
+    """Graph with x- and y-axis, as matplotlib Axes.
+
+    Attributes
+    ----------
+    plot : pyqtgraph.PlotItem
+        Graph with axes, title and labels
+    view : pyqtgraph.ViewBox
+        Area where data are drawn, scaled by the axes
+    """
+
+    def __init__(self, plot, view):
+        """Wrap plot item and view box."""
+        self.plot = plot
+        self.view = view
+        self.view.disableAutoRange()    # Limits are set by program
+
+    @property
+    def bbox(self):
+        """Size of drawing area in pixels, as matplotlib Axes.bbox."""
+        return Bbox(self.view.width(), self.view.height())
+
+    def set_xlim(self, left, right=None):
+        """Set limits of x-axis, as two values or one list."""
+        if right is None:
+            left, right = left
+        self.view.setXRange(left, right, padding=0)
+        return 0
+
+    def set_ylim(self, bottom, top=None):
+        """Set limits of y-axis, as two values or one list."""
+        if top is None:
+            bottom, top = bottom
+        self.view.setYRange(bottom, top, padding=0)
+        return 0
+
+    def set_ylabel(self, label, color=None):
+        """Set label of y-axis, on right side if twin axis."""
+        side = "left" if self.view is self.plot.vb else "right"
+        self.plot.setLabel(side, label)
+        if color is not None:
+            axis = self.plot.getAxis(side)
+            axis.setPen(mcolors.to_hex(color))
+            axis.setTextPen(mcolors.to_hex(color))
+        return 0
+
+    def twinx(self):
+        """Add second y-axis on right side, sharing x-axis.
+
+        Returns
+        -------
+        axis : Axis class
+            New axis, data drawn in same area as this axis
+        """
+        view = pg.ViewBox()
+        self.plot.showAxis("right")
+        self.plot.scene().addItem(view)
+        self.plot.getAxis("right").linkToView(view)
+        view.setXLink(self.plot.vb)
+
+        def update_geometry():
+            view.setGeometry(self.plot.vb.sceneBoundingRect())
+
+        self.plot.vb.sigResized.connect(update_geometry)
+        update_geometry()
+        return Axis(self.plot, view)
+
+    def plot_line(self, color, width=1):
+        """Add line for data.
+
+        Long traces are reduced to min. and max. values per pixel when
+        drawn, and only the visible part is drawn.
+
+        Parameters
+        ----------
+        color : str
+            Line colour, matplotlib colour name
+        width : float
+            Line width, pixels
+
+        Returns
+        -------
+        line : Line class
+            New line, no data
+        """
+        item = pg.PlotDataItem(pen=pg.mkPen(mcolors.to_hex(color),
+                                            width=width))
+        item.setDownsampling(auto=True, method="peak")
+        item.setClipToView(True)
+        self.view.addItem(item)
+        return Line(item)
+
+    def add_rectangle(self, color):
+        """Add filled rectangle, behind the lines.
+
+        Parameters
+        ----------
+        color : str
+            Fill colour, matplotlib colour name
+
+        Returns
+        -------
+        patch : Rectangle class
+            New rectangle, zero size
+        """
+        item = QtWidgets.QGraphicsRectItem(0, 0, 0, 0)
+        item.setBrush(pg.mkBrush(mcolors.to_hex(color)))
+        item.setPen(pg.mkPen(None))
+        item.setZValue(-100)
+        self.view.addItem(item, ignoreBounds=True)
+        return Rectangle(item)
+
+
+class Line:
+    """Line showing data, as matplotlib Line2D.
+
+    Attributes
+    ----------
+    item : pyqtgraph.PlotDataItem
+        Line in graph
+    """
+
+    def __init__(self, item):
+        """Wrap plot data item."""
+        self.item = item
+
+    def set_data(self, x, y):
+        """Replace data, x and y are arrays of equal length."""
+        self.item.setData(np.ravel(x), np.ravel(y))
+        return 0
+
+    def set_linestyle(self, style):
+        """Set line style, "solid", "dotted" or "dashed"."""
+        pen = pg.mkPen(self.item.opts["pen"])
+        pen.setStyle(LINE_STYLES[style])
+        self.item.setPen(pen)
+        return 0
+
+
+class Rectangle:
+    """Filled rectangle, as matplotlib Rectangle.
+
+    Attributes
+    ----------
+    item : QGraphicsRectItem
+        Rectangle in graph
+    """
+
+    def __init__(self, item):
+        """Wrap rectangle item."""
+        self.item = item
+
+    def set_bounds(self, x, y, width, height):
+        """Set position of lower left corner, width and height."""
+        self.item.setRect(QtCore.QRectF(x, y, width, height))
+        return 0
+
+
+class Renderer:
+    """Draw graphs, same interface as BlitRenderer in acquire_ultrasound.py.
+
+    pyqtgraph redraws changed items when the Qt event loop runs, so no
+    explicit drawing is needed.
+
+    Attributes
+    ----------
+    fig : Figure class
+        Window containing the graphs
+    resize_axis : Axis class
+        Axis monitored for change in size, see connect_resize()
+    """
+
+    def __init__(self, fig, resize_axis=None):
+        """Store figure."""
+        self.fig = fig
+        self.resize_axis = resize_axis
+
+    def update(self):
+        """Draw new traces."""
+        return 0
+
+    def redraw(self):
+        """Draw after change in axes, markers etc."""
+        return 0
+
+    def connect_resize(self, function):
+        """Call function(event) when the graph size changes."""
+        if self.resize_axis is not None:
+            self.resize_axis.view.sigResized.connect(
+                lambda view: function(None))
+        return 0
+
+    def close(self):
+        """Close window."""
+        return self.fig.close()
@@ -7,17 +7,47 @@ coding: utf-8 -*-
 Created on Tue Sep 13 21:46:41 2022
 """
 
-import copy
+from functools import lru_cache
 # from math import pi, radians, cos, log10, floor, frexp
 from math import pi, radians, log10, floor, frexp
 import numpy as np
 from scipy import signal
+from scipy import fft
 from scipy.signal import windows
 import matplotlib.pyplot as plt
 import os
+import time
+import threading
+import glob
+import warnings
+from mmap import mmap as map_file, ACCESS_READ
+import json
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 import pdb
 
+# Index at end of 'WaveformSeries' files. One record per trace
+SERIES_INDEX = np.dtype([('offset', '>u8'),        # Start of trace record
+                         ('data_offset', '>u8'),   # Start of data points
+                         ('n_samples', '>u8'),
+                         ('n_channels', '>u4'),
+                         ('t0', '>f8'),
+                         ('dt', '>f8'),
+                         ('dtr', '>f8')])
+SERIES_MAGIC = b'WFMINDEX'   # Identifies trailer at end of file
+SERIES_DTYPE = '>f4'         # Data points in series, always floats
+SERIES_TRAILER_SIZE = 8 + 8 + len(SERIES_MAGIC)   # Offset, count, magic
+
+CATALOG_FILE = "wfm_catalog.json"   # Cached headers of files in directory
+CATALOG_FIELDS = ['header', 'n_channels', 't0', 'dt', 'dtr',
+                  'data_offset', 'n_samples', 'dtype', 'scale']
+
+# Headers of 'Waveform' files give data format. Raw files store integer
+# values, e.g. ADC counts, with one scale factor per channel
+WFM_HEADER = "<WFM_Python_>f4>"
+WFM_HEADER_RAW = "<WFM_Python_>i2>"
+MAX_CHANNELS = 64   # More channels in a header means the file is corrupt
+
 
 # %% Classes
 
@@ -38,6 +68,9 @@ class Waveform:
         interval between sample blocks. Rarely used
     y : 2D array of float
         Results. Each column is a channel, samples as rows
+    scale : 1D array of float
+        Scale factor for each channel if y is raw, e.g., ADC counts to
+        Volts. None if y is already scaled
 
     Methods
     -------
@@ -53,20 +86,22 @@ class Waveform:
         Number of points used to calculate spectrum
     f : 1D array of float
         Frequency vector
+    scaled : Waveform class
+        Raw traces scaled to physical units, e.g., Volts
     powerspectrum : 1D array of float
         Powerspectrum of traces
     filtered : Waveform class
         Bandpass filtered traces, all else equal
     zoomed : Waveform class
-        Zoomed to specified interval, all else identtical
+        Zoomed to specified interval, all else identical. View of data
     plot : function
         Plots result in figure
     plot_spectrum : function
         Plots traces and spectrum
     save : function
-        Loads Waveform from binary file
-    load : function
         Saves Waveform to binary file
+    load : function
+        Loads Waveform from binary file, optionally memory-mapped
     """
 
     def __init__(self, y=np.zeros((100, 1)), dt=1, t0=0):
@@ -77,6 +112,7 @@ class Waveform:
         self.dt = dt             # [s]  Sample interval
         self.t0 = t0             # [s]  Time of first sample
         self.dtr = 0             # [s]  interval between blocks. Obsolete
+        self.scale = None        # Scale factors if y is raw, e.g., counts
 
     def n_channels(self):
         """Find number of data channels in trace."""
@@ -86,14 +122,32 @@ class Waveform:
         """Find number of points in trace."""
         return self.y.shape[0]
 
-    def t(self):
+    def t(self, n_start=0, n_stop=None):
         """Time vector [s].
 
-        Calculated from start time and sample interval [s]
+        Calculated from start time and sample interval [s], sample k is at
+        time t0 + k*dt. The full vector is cached and shared with other
+        traces with equal time scale, so it is returned as a read-only
+        array. Copy it before changing values. A part n_start:n_stop is
+        calculated as a new array, without making the full vector.
+
+        Parameters
+        ----------
+        n_start : int
+            Index of first sample
+        n_stop : int
+            Index after last sample. End of trace if None
+
+        Returns
+        -------
+        t : 1D array of float
+            Time vector, read-only if the full trace is requested
         """
-        return np.linspace(self.t0,
-                           self.t0+self.dt*self.n_samples(),
-                           self.n_samples())
+        n_samples = self.n_samples()
+        n_start, n_stop, step = slice(n_start, n_stop).indices(n_samples)
+        if (n_start, n_stop) == (0, n_samples):
+            return time_vector(self.t0, self.dt, n_samples)
+        return self.t0 + self.dt*np.arange(n_start, n_stop)
 
     def fs(self):
         """Sample rate [Hz]."""
@@ -115,9 +169,33 @@ class Waveform:
         # n = 2**(self.n_samples().bit_length() +upsample)  # Next power of 2
         return max(n, 2048)
 
-    def f(self):
-        """Frequency vector [Hz]."""
-        return np.arange(0, self.n_fft()/2)/self.n_fft() * self.fs()
+    def f(self, upsample=0):
+        """Frequency vector [Hz], 0 to Nyquist-frequency.
+
+        Same as from powerspectrum() with equal upsample. Cached and
+        shared, read-only
+
+        Parameters
+        ----------
+        upsample : int
+            Number of extra powers of 2 in FFT, see n_fft()
+        """
+        return frequency_vector(self.n_fft(upsample=upsample), self.dt)
+
+    def scaled(self):
+        """Trace scaled to physical units, e.g., from ADC counts to Volts.
+
+        Returns
+        -------
+        wfm : Waveform
+            New waveform with scaled data as float, all else equal.
+            The original waveform if y is already scaled
+        """
+        if self.scale is None:
+            return self
+        wfm = Waveform(self.y*np.asarray(self.scale), dt=self.dt, t0=self.t0)
+        wfm.dtr = self.dtr
+        return wfm
 
     def powerspectrum(self, normalise=False, scale="linear", upsample=2):
         """Calculate power spectrum of time trace.
@@ -138,9 +216,9 @@ class Waveform:
         psd : 2D array
             Power spectral density
         """
-        f, psd = powerspectrum(self.y,
+        f, psd = powerspectrum(self.scaled().y,
                                self.dt,
-                               n_fft=self.n_fft(upsample=2),
+                               n_fft=self.n_fft(upsample=upsample),
                                scale=scale,
                                normalise=normalise)
         return f, psd
@@ -156,40 +234,49 @@ class Waveform:
         Returns
         -------
         wfm : Waveform
-            Copy of original waveform with filtered data
+            New waveform with filtered and scaled data, all else equal.
+            Shares data with original if filter type is "No"
         """
-        wfm = copy.deepcopy(self)
+        y = self.scaled().y
         match(filter.type[0:2].lower()):
             case "no":
-                wfm.y = self.y
+                pass
             case "ac":
-                dc_level = self.y.mean(axis=0)
-                wfm.y = self.y - dc_level
+                dc_level = y.mean(axis=0)
+                y = y - dc_level
             case _:
-                b, a = filter.coefficients()
-                wfm.y = signal.filtfilt(b, a, self.y, axis=0)
+                y = signal.sosfiltfilt(filter.sos(), y, axis=0)
+        wfm = Waveform(y, dt=self.dt, t0=self.t0)
+        wfm.dtr = self.dtr
         return wfm
 
-    def zoomed(self, tlim):
-        """Extract copy of trace from interval in specified by tlim.
+    def zoomed(self, tlim, copy=False):
+        """Extract trace from interval specified by tlim.
+
+        Sample indices are calculated from t0 and dt, the data are not
+        copied unless requested.
 
         Parameters
         ----------
         tlim : List of float
             Start and end of interval to select
+        copy : bool
+            Return copy of data instead of view into original trace
 
         Returns
         -------
         wfm : Waveform class
-            Copy of original waveform zommed to interval
+            Original waveform zoomed to interval
 
         """
-        wfm = copy.deepcopy(self)
-        nlim = np.flatnonzero((self.t() >= min(tlim))
-                              & (self.t() <= max(tlim)))
-
-        wfm.t0 = self.t()[np.min(nlim)]
-        wfm.y = self.y[nlim]
+        n_start, n_stop = find_sample_range(tlim, self.t0, self.dt,
+                                            self.n_samples())
+        y = self.y[n_start:n_stop]
+        if copy:
+            y = y.copy()
+        wfm = Waveform(y, dt=self.dt, t0=self.t0 + n_start*self.dt)
+        wfm.dtr = self.dtr
+        wfm.scale = self.scale
         return wfm
 
     def plot(self, time_unit="us", ch=[0, 1], y_max=None):
@@ -204,7 +291,7 @@ class Waveform:
         y_max : float
             Max. scale on amplitude-axis
         """
-        plot_pulse(self.t(), self.y[ch], time_unit, y_max)
+        plot_pulse(self.t(), self.scaled().y[ch], time_unit, y_max)
 
         return 0
 
@@ -231,7 +318,7 @@ class Waveform:
         ax :List of axis objects
             Axes to plot time trace and spectrum
         """
-        plot_spectrum(self.t(), self.y[:, ch], time_unit=time_unit,
+        plot_spectrum(self.t(), self.scaled().y[:, ch], time_unit=time_unit,
                       y_max=y_max, f_max=f_max, n_fft=self.n_fft(),
                       normalise=normalise, scale=scale, db_min=db_min, ax=ax)
         return 0
@@ -242,6 +329,9 @@ class Waveform:
         Compatible with internal format used since 1990s on a variety of
         platforms (LabWindows, C, LabVIEW, Matlab)
         Uses 'c-order' of arrays and IEEE big-endian byte order
+        Raw traces, i.e., scale is not None, are saved as 2-byte integers
+        followed by the scale factors, see write_header(). Half the size,
+        but not readable by older programs.
         Complements load()
 
         Parameters
@@ -260,23 +350,22 @@ class Waveform:
             Sample interval
         dtr : float
             interval between blocks. Used only in special cases
+        scale : 1D array of float
+            Scale factor for each channel, raw traces only
         v : 2D array of float
             Data points (often voltages)
         """
-        header = "<WFM_Python_>f4>"    # Header gives source and data format
-        n_header = len(header)
-        # y = np.require( self.v, requirements='C' )
         with open(filename, 'xb') as fid:
-            fid.write(np.array(n_header).astype('>i4'))
-            fid.write(bytes(header, 'utf-8'))
-            fid.write(np.array(self.n_channels()).astype('>u4'))
-            fid.write(np.array(self.t0).astype('>f8'))
-            fid.write(np.array(self.dt).astype('>f8'))
-            fid.write(np.array(self.dtr).astype('>f8'))
-            fid.write(self.y.astype('>f4'))
+            write_header(fid, self.n_channels(), self.t0, self.dt, self.dtr,
+                         scale=self.scale)
+            if self.scale is None:
+                fid.write(self.y.astype('>f4', order='C'))
+            else:
+                fid.write(self.y.astype('>i2', order='C'))
         return 0
 
-    def load(self, filename):
+    def load(self, filename, mmap=False, tlim=None, channels=None,
+             raw=False):
         """Load 'Waveform' files from binary file, as 4-byte (sgl) floats.
 
         Loads contents of file into the variable.
@@ -289,20 +378,61 @@ class Waveform:
         ----------
         filename : str
             Full path of file to load
+        mmap : bool
+            Map data in file to memory instead of reading them.
+            y becomes a read-only view of the file, big-endian byte order
+            is converted only for the samples that are used. Intended for
+            files too large to fit in memory. Raw traces are kept unscaled,
+            as if raw is True, and scaled when used, see scaled().
+            Selecting channels that are not consecutive copies them to
+            memory.
+        tlim : List of float
+            Start and end of interval to load. Only the samples inside
+            this interval are read from file. Loads all if None
+        channels : int or List of int
+            Channels to load. Loads all if None
+        raw : bool
+            Keep raw traces from file unscaled, with scale factors in
+            scale. Raw traces are scaled to float when loaded if False,
+            except when memory-mapped. No effect on files with floats
         """
-        with open(filename, 'rb') as fid:
-            n_header = int(np.fromfile(fid, dtype='>i4', count=1))
-            header_bytes = fid.read(n_header)
-            self.header = header_bytes.decode("utf-8")
-
-            n_ch = int(np.fromfile(fid, dtype='>u4', count=1))
-            self.t0 = float(np.fromfile(fid, dtype='>f8', count=1))
-            self.dt = float(np.fromfile(fid, dtype='>f8', count=1))
-            self.dtr = float(np.fromfile(fid, dtype='>f8', count=1))
-            y = np.fromfile(fid, dtype='>f4', count=-1)   # Traces, 2D array
-            self.y = np.reshape(y, (-1, n_ch))
-
-            self.sourcefile = filename
+        info = read_header(filename)
+        self.header = info.header
+        self.dt = info.dt
+        self.dtr = info.dtr
+        if tlim is None:
+            n_start, n_stop = 0, info.n_samples
+        else:
+            n_start, n_stop = find_sample_range(tlim, info.t0, info.dt,
+                                                info.n_samples)
+        self.t0 = info.t0 + n_start*info.dt
+        row_size = np.dtype(info.dtype).itemsize*info.n_channels
+        shape = (n_stop-n_start, info.n_channels)
+        if mmap:
+            y = np.memmap(filename, dtype=info.dtype, mode='r',
+                          offset=info.data_offset + n_start*row_size,
+                          shape=shape)
+        else:
+            with open(filename, 'rb') as fid:
+                fid.seek(info.data_offset + n_start*row_size)
+                y = np.fromfile(fid, dtype=info.dtype, count=np.prod(shape))
+            y = np.reshape(y, shape)   # Traces, 2D array
+        scale = info.scale
+        if channels is not None:
+            index = channel_index(channels)    # View if possible
+            y = y[:, index]
+            if scale is not None:
+                scale = np.asarray(scale)[index]
+        self.scale = None
+        if scale is None:
+            self.y = y
+        elif raw or mmap:     # Scaled when used, file is not read here
+            self.y = y
+            self.scale = np.asarray(scale)
+        else:
+            self.y = y*np.asarray(scale)
+
+        self.sourcefile = filename
         return 0
 
 
@@ -491,6 +621,8 @@ class WaveformFilter:
         Cutoff-frequencies normalised to sample rate
     coefficients : 1D array of float
         Filter coefficients, b and a
+    sos : 2D array of float
+        Filter as second-order sections, cached
     """
 
     type = "No"          # Filter type: 'NO, 'AC', 'BPF'
@@ -511,6 +643,489 @@ class WaveformFilter:
                              output='ba')
         return b, a
 
+    def sos(self):
+        """Return filter as second-order sections, numerically robust.
+
+        Cached, the filter is designed only when the specification changes
+        """
+        return filter_sos(self.order, self.f_min, self.f_max, self.fs)
+
+
+class StreamingFilter:
+    """Filter continuous data block by block, defined by "WaveformFilter".
+
+    The filter state is carried from one block to the next, so a stream
+    split in blocks is filtered as one long trace, without transients at
+    the block edges. The filter is causal by default. With n_delay > 0,
+    a backward pass over the last n_delay samples approximates zero-phase
+    filtering as in Waveform.filtered(), output delayed by n_delay samples.
+
+    Use only for blocks that are contiguous in time, e.g. from
+    stream_blocks() in the Picoscope wrappers. Separate recordings are
+    filtered one by one with Waveform.filtered().
+
+    If the filter is changed during a stream, e.g. type or cutoff
+    frequencies, the stream is restarted as by reset(). The filter state
+    and the samples held back for the zero-phase approximation are
+    discarded.
+
+    Attributes
+    ----------
+    filter : WaveformFilter
+        Filter specification. Stream is restarted if the filter is changed
+    spec : tuple
+        Type, cutoff frequencies, order and sample rate of filter in use
+    sos : 2D array of float
+        Filter in use, as second-order sections
+    n_delay : int
+        Delay in samples for zero-phase approximation. 0 for causal filter
+    zi : 3D array of float
+        Filter state, carried between blocks
+    pending : 2D array of float
+        Samples held back for the zero-phase approximation
+    delay : int
+        No. of samples the output of the last block starts before its
+        input, i.e., samples held back from the block before
+
+    Methods
+    -------
+    filter_block : 2D array of float
+        Filter next block of samples
+    filtered : Waveform class
+        Filter next block of samples in Waveform
+    reset : function
+        Clear filter state, to start new stream
+    """
+
+    def __init__(self, filter, n_delay=0):
+        """Initialise with filter specification and delay."""
+        self.filter = filter
+        self.n_delay = n_delay
+        self.reset()
+
+    def reset(self):
+        """Clear filter state and held back samples, to start new stream."""
+        self.spec = None
+        self.sos = None
+        self.zi = None
+        self.pending = None
+        self.delay = 0
+        return 0
+
+    def filter_block(self, y):
+        """Filter next block of samples.
+
+        Parameters
+        ----------
+        y : 2D array of float
+            Block of samples. Each column is a channel, samples as rows
+
+        Returns
+        -------
+        y_filtered : 2D array of float
+            Filtered samples. With n_delay > 0, the n_delay last samples
+            are held back and returned with the next block
+        """
+        match(self.filter.type[0:2].lower()):
+            case "no":
+                self.reset()        # Filter off, restart when on again
+                return y
+            case "ac":
+                self.reset()
+                return y - y.mean(axis=0)
+
+        spec = (self.filter.type, self.filter.f_min, self.filter.f_max,
+                self.filter.order, self.filter.fs)
+        if spec != self.spec:     # New filter, or first block
+            self.reset()
+            self.spec = spec
+            self.sos = self.filter.sos()
+            self.zi = (signal.sosfilt_zi(self.sos)[:, :, np.newaxis]
+                       * y[0])      # Start in steady state, no transient
+            self.pending = y[0:0]
+        sos = self.sos
+        y_filtered, self.zi = signal.sosfilt(sos, y, axis=0, zi=self.zi)
+        if self.n_delay == 0:
+            return y_filtered
+
+        # Backward pass over held back and new samples
+        self.delay = len(self.pending)
+        y_buffer = np.concatenate((self.pending, y_filtered))
+        n_out = max(len(y_buffer) - self.n_delay, 0)
+        zi_back = signal.sosfilt_zi(sos)[:, :, np.newaxis] * y_buffer[-1]
+        y_back, zf = signal.sosfilt(sos, y_buffer[::-1], axis=0, zi=zi_back)
+        self.pending = y_buffer[n_out:]
+        return y_back[::-1][:n_out]
+
+    def filtered(self, wfm):
+        """Filter next block in stream, stored as Waveform.
+
+        Parameters
+        ----------
+        wfm : Waveform class
+            Next block of samples, raw or scaled
+
+        Returns
+        -------
+        wfm_filtered : Waveform class
+            Filtered and scaled samples, start time corrected for samples
+            held back from the block before
+        """
+        y = self.filter_block(wfm.scaled().y)
+        wfm_filtered = Waveform(y, dt=wfm.dt, t0=wfm.t0-self.delay*wfm.dt)
+        wfm_filtered.dtr = wfm.dtr
+        return wfm_filtered
+
+
+class DisplayPipeline:
+    """Filter, zoom and power spectrum of traces for live display.
+
+    Results are written to arrays owned by the pipeline, allocated once and
+    reused for every trace. They are reallocated only when the trace
+    length, number of channels, time scale or zoomed interval changes.
+    FFT plans are reused by scipy.fft for the fixed FFT length. Results
+    are overwritten by the next trace, copy if they shall be kept.
+
+    Attributes
+    ----------
+    filter : WaveformFilter
+        Filter applied to traces
+    upsample : int
+        Extra powers of 2 in FFT, see Waveform.n_fft()
+    scale : str
+        Power spectrum scale, Linear (Power) or dB
+    normalise : bool
+        Normalise power spectrum to 1 (0 dB) as maximum
+    time_scale : float
+        Time unit for t and t_zoom, e.g. 1e-6 for us
+    frequency_scale : float
+        Frequency unit for f, e.g. 1e6 for MHz
+    workers : int
+        Number of threads used by FFT, default if None
+    t : 1D array of float
+        Time vector of full trace, in time_scale units
+    y_filtered : 2D array of float
+        Filtered trace
+    t_zoom : 1D array of float
+        Time vector of zoomed interval, in time_scale units
+    y_zoom : 2D array of float
+        Filtered trace in zoomed interval, view into y_filtered
+    f : 1D array of float
+        Frequency vector, in frequency_scale units
+    psd : 2D array of float
+        Power spectrum of zoomed interval
+    timing : dict of float
+        Duration of stages "scale", "filter" and "spectrum" for last
+        trace [s]
+
+    Methods
+    -------
+    process : function
+        Process new trace, results to attributes
+    """
+
+    def __init__(self, filter=None, upsample=2, scale="dB", normalise=True,
+                 time_scale=1, frequency_scale=1, workers=None):
+        """Initialise settings. Arrays are allocated by first trace."""
+        if filter is None:
+            filter = WaveformFilter()
+        self.filter = filter
+        self.upsample = upsample
+        self.scale = scale
+        self.normalise = normalise
+        self.time_scale = time_scale
+        self.frequency_scale = frequency_scale
+        self.workers = workers
+        self.layout = None
+        self.timing = {"scale": 0.0, "filter": 0.0, "spectrum": 0.0}
+
+    def allocate(self, wfm, n_start, n_stop, n_fft):
+        """Allocate result arrays and axes for trace and zoomed interval."""
+        n_samples, n_channels = wfm.y.shape
+        self.y_filtered = np.empty((n_samples, n_channels))
+        self.y_padded = np.zeros((n_fft, n_channels))   # Input to FFT
+        self.psd = np.empty((n_fft//2+1, n_channels))
+
+        self.t = time_vector(wfm.t0, wfm.dt, n_samples)/self.time_scale
+        self.t_zoom = self.t[n_start:n_stop]
+        self.y_zoom = self.y_filtered[n_start:n_stop]
+        f, self.psd_scale = spectrum_scaling(n_stop-n_start, n_fft, wfm.dt)
+        self.f = f/self.frequency_scale
+        return 0
+
+    def process(self, wfm, tlim):
+        """Filter trace, extract zoomed interval and calculate spectrum.
+
+        Parameters
+        ----------
+        wfm : Waveform class
+            Acquired trace
+        tlim : List of float
+            Start and end of zoomed interval
+        """
+        n_start, n_stop = find_sample_range(tlim, wfm.t0, wfm.dt,
+                                            wfm.n_samples())
+        n_zoom = n_stop - n_start
+        m, e = frexp(n_zoom)
+        n_fft = max(2**(e+self.upsample), 2048)    # As Waveform.n_fft()
+        layout = (wfm.y.shape, wfm.t0, wfm.dt, n_start, n_stop, n_fft)
+        if layout != self.layout:
+            self.allocate(wfm, n_start, n_stop, n_fft)
+            self.layout = layout
+
+        # Scale raw traces, e.g. ADC counts to Volts, into pre-allocated
+        # array. Then filter in place
+        t_start = time.perf_counter()
+        if wfm.scale is None:
+            np.copyto(self.y_filtered, wfm.y)
+        else:
+            np.multiply(wfm.y, wfm.scale, out=self.y_filtered)
+        t_scaled = time.perf_counter()
+        match(self.filter.type[0:2].lower()):
+            case "no":
+                pass
+            case "ac":
+                self.y_filtered -= self.y_filtered.mean(axis=0)
+            case _:
+                self.y_filtered[:] = signal.sosfiltfilt(self.filter.sos(),
+                                                        self.y_filtered,
+                                                        axis=0)
+        t_filtered = time.perf_counter()
+
+        # Power spectrum of zoomed interval. Zero-padding is kept
+        self.y_padded[:n_zoom] = self.y_zoom
+        y_fft = fft.rfft(self.y_padded, axis=0, workers=self.workers)
+        np.abs(y_fft, out=self.psd)
+        np.square(self.psd, out=self.psd)
+        np.multiply(self.psd, self.psd_scale[:, np.newaxis], out=self.psd)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.normalise:
+                np.divide(self.psd, self.psd.max(axis=0), out=self.psd)
+            if self.scale.lower() == "db":
+                np.log10(self.psd, out=self.psd)
+                np.multiply(self.psd, 10, out=self.psd)
+        self.timing = {"scale": t_scaled - t_start,
+                       "filter": t_filtered - t_scaled,
+                       "spectrum": time.perf_counter() - t_filtered}
+        return 0
+
+
+class RunningAverage:
+    """Exponential moving average of traces, for live display.
+
+    The average is updated in place for every new trace, no arrays are
+    allocated. Starts as a plain mean of the traces received, until
+    n_average traces are reached. Older traces are then weighted down
+    exponentially. Restarts when the trace length or time scale changes.
+
+    Attributes
+    ----------
+    n_average : int
+        Effective number of traces in average. No averaging if 1
+    n_traces : int
+        Number of traces received since start, max. n_average
+    y : 2D array of float
+        Average, scaled if traces are raw. Each column is a channel
+    work : 2D array of float
+        Work array for the weighted new trace, allocated with y
+
+    Methods
+    -------
+    add : Waveform class
+        Add trace to average, returns average
+    reset : function
+        Clear average, start again
+    """
+
+    def __init__(self, n_average=16):
+        """Initialise with effective number of traces in average."""
+        self.n_average = n_average
+        self.reset()
+
+    def reset(self):
+        """Clear average, start again."""
+        self.n_traces = 0
+        self.layout = None
+        self.y = None
+        self.work = None
+        return 0
+
+    def add(self, wfm):
+        """Add trace to average.
+
+        Parameters
+        ----------
+        wfm : Waveform class
+            New trace, raw or scaled
+
+        Returns
+        -------
+        wfm_average : Waveform class
+            Average, data are overwritten by the next trace.
+            The trace itself if n_average is 1
+        """
+        if self.n_average <= 1:
+            return wfm
+        layout = (wfm.y.shape, wfm.t0, wfm.dt)
+        if layout != self.layout:
+            self.y = np.zeros(wfm.y.shape)
+            self.work = np.zeros(wfm.y.shape)
+            self.n_traces = 0
+            self.layout = layout
+        self.n_traces = min(self.n_traces+1, self.n_average)
+
+        weight = 1/self.n_traces
+        scale = 1 if wfm.scale is None else np.asarray(wfm.scale)
+        np.multiply(wfm.y, weight*scale, out=self.work)
+        self.y *= 1-weight
+        self.y += self.work
+
+        wfm_average = Waveform(self.y, dt=wfm.dt, t0=wfm.t0)
+        wfm_average.dtr = wfm.dtr
+        return wfm_average
+
+
+class RateMonitor:
+    """Event rates and stage timing for live status display.
+
+    Events, e.g. acquired traces and displayed frames, are counted from
+    any thread. Rates are calculated when update() is called, averaged
+    over at least 'interval' seconds. Stage timings are smoothed by an
+    exponential moving average.
+
+    Attributes
+    ----------
+    interval : float
+        Minimum time between rate updates [s]
+    weight : float
+        Weight of new timing values in moving average, 0 to 1
+    rate : dict of float
+        Events per second, by event name
+    timing : dict of float
+        Average duration of each stage [s], by stage name
+
+    Methods
+    -------
+    count : function
+        Count events
+    add_timing : function
+        Add durations of stages
+    update : function
+        Calculate rates if interval has passed
+    summary : function
+        Rates and timing as text
+    """
+
+    def __init__(self, interval=1.0, weight=0.1):
+        """Initialise, no events counted."""
+        self.interval = interval
+        self.weight = weight
+        self.reset()
+
+    def reset(self):
+        """Clear counters, rates and timing."""
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.rate = {}
+        self.timing = {}
+        self.t_last = time.perf_counter()
+        return 0
+
+    def count(self, name, n=1):
+        """Count n events of type name."""
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+        return 0
+
+    def add_timing(self, timing):
+        """Add durations of stages, dict of stage name and duration [s]."""
+        with self.lock:
+            for stage, duration in timing.items():
+                previous = self.timing.get(stage, duration)
+                self.timing[stage] = (previous
+                                      + self.weight*(duration-previous))
+        return 0
+
+    def update(self):
+        """Calculate event rates, if interval has passed since last update.
+
+        Returns
+        -------
+        updated : bool
+            Rates were updated
+        """
+        t_now = time.perf_counter()
+        t_elapsed = t_now - self.t_last
+        if t_elapsed < self.interval:
+            return False
+        with self.lock:
+            self.rate = {name: n/t_elapsed
+                         for name, n in self.counts.items()}
+            self.counts = dict.fromkeys(self.counts, 0)
+        self.t_last = t_now
+        return True
+
+    def summary(self, time_unit=1e-3, unit_name="ms"):
+        """Rates and timing as one line of text.
+
+        Parameters
+        ----------
+        time_unit : float
+            Unit for stage durations [s]
+        unit_name : str
+            Name of time unit
+
+        Returns
+        -------
+        text : str
+            E.g. "acquired 52.0/s  displayed 30.0/s | draw 20.3 ms"
+        """
+        rates = "  ".join(f"{name} {rate:.1f}/s"
+                          for name, rate in self.rate.items())
+        with self.lock:
+            timing = "  ".join(f"{stage} {duration/time_unit:.1f}"
+                               for stage, duration in self.timing.items())
+        return f"{rates} | {timing} {unit_name}"
+
+
+class WaveformFileInfo:
+    """Header information and data layout of 'Waveform' binary file.
+
+    Attributes
+    ----------
+    sourcefile : str
+        Full path of file
+    header : str
+        Header, informative text
+    n_channels : int
+        Number of data channels
+    t0 : float
+        Start time
+    dt : float
+        Sample interval
+    dtr : float
+        Interval between blocks. Used only in special cases
+    data_offset : int
+        Position of first data point in file, bytes
+    n_samples : int
+        Number of samples per channel, found from file size
+    dtype : str
+        Format of data points, '>f4' for floats, '>i2' for raw files
+    scale : List of float
+        Scale factor for each channel, raw files only. None for floats
+    """
+
+    sourcefile = ''
+    header = ''
+    n_channels = 1
+    t0 = 0
+    dt = 1
+    dtr = 0
+    data_offset = 0
+    n_samples = 0
+    dtype = '>f4'
+    scale = None
+
 
 class ResultFile:
     """Path, name and counter for resultfile."""
@@ -523,6 +1138,369 @@ class ResultFile:
     counter = 0
 
 
+class WaveformWriter:
+    """Write traces to 'Waveform' binary file block by block.
+
+    The header is written once when the file is opened, data blocks are
+    appended as they arrive. The file format has no length field, so the
+    number of samples is given by the file size only. Used for continuous
+    recording without keeping all traces in memory.
+
+    Attributes
+    ----------
+    filename : str
+        Full path of result file
+    n_channels : int
+        Number of data channels
+    flush_interval : int
+        Number of blocks written between each flush to disk
+    n_blocks : int
+        Number of blocks written
+    n_samples : int
+        Number of samples per channel written
+
+    Methods
+    -------
+    write : function
+        Append block of samples to file
+    flush : function
+        Write buffered data to disk
+    close : function
+        Close file
+    """
+
+    def __init__(self, filename, n_channels, dt, t0=0, dtr=0,
+                 flush_interval=100, scale=None):
+        """Open new file and write header.
+
+        Parameters
+        ----------
+        filename : str
+            Full path of file to save data in
+        n_channels : int
+            Number of data channels
+        dt : float
+            Sample interval
+        t0 : float
+            Start time
+        dtr : float
+            Interval between blocks
+        flush_interval : int
+            Number of blocks written between each flush to disk
+        scale : 1D array of float
+            Scale factor for each channel if blocks are raw, e.g., ADC
+            counts. Data points are written as 2-byte integers
+        """
+        self.filename = filename
+        self.n_channels = n_channels
+        self.flush_interval = flush_interval
+        self.n_blocks = 0
+        self.n_samples = 0
+        self.dtype = '>f4' if scale is None else '>i2'
+        self.fid = open(filename, 'xb')
+        write_header(self.fid, n_channels, t0, dt, dtr, scale=scale)
+
+    def __enter__(self):
+        """Use as context manager, file is closed at exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close file when leaving context."""
+        self.close()
+
+    def write(self, y):
+        """Append block of samples to file.
+
+        Parameters
+        ----------
+        y : 2D array of float
+            Data points. Each column is a channel, samples as rows
+        """
+        y = np.asarray(y)
+        if y.ndim == 1:
+            y = y.reshape((-1, 1))
+        if y.shape[1] != self.n_channels:
+            raise ValueError(f"Block has {y.shape[1]} channels, "
+                             f"file has {self.n_channels}")
+        self.fid.write(y.astype(self.dtype, order='C'))
+        self.n_blocks += 1
+        self.n_samples += y.shape[0]
+        if self.n_blocks % self.flush_interval == 0:
+            self.flush()
+        return 0
+
+    def flush(self):
+        """Write buffered data to disk."""
+        self.fid.flush()
+        return 0
+
+    def close(self):
+        """Close file."""
+        if not self.fid.closed:
+            self.fid.close()
+        return 0
+
+
+class WaveformSeries:
+    """Series of 'Waveform' traces stored in one file, with an index.
+
+    Each trace is stored as a complete record identical to a single-trace
+    file from Waveform.save(), so single traces can be exported to the
+    format read by LabVIEW and Matlab by copying bytes. An index with the
+    position and time scale of every trace is written at the end of the
+    file, followed by a trailer pointing to the index. Any trace can be
+    read directly, without reading the traces before it.
+
+    The index is written when the file is closed. If a file was not
+    closed, e.g. after a crash, the index is rebuilt by searching for the
+    trace records, see scan_records(). The index is kept in the file until
+    the first trace is appended.
+
+    File layout
+    -----------
+    Trace records, back to back
+    Index, SERIES_INDEX record for each trace
+    Trailer, byte position of index, number of traces, SERIES_MAGIC
+
+    Attributes
+    ----------
+    filename : str
+        Full path of file
+    mode : str
+        'r' for reading, 'a' for reading and appending
+    index : List of tuple
+        Position and time scale of each trace, see SERIES_INDEX
+
+    Methods
+    -------
+    read : Waveform class
+        Read one trace
+    append : function
+        Append trace to end of file
+    append_file : function
+        Append trace from single-trace file
+    export : function
+        Save one trace to single-trace file
+    close : function
+        Write index and close file
+    """
+
+    def __init__(self, filename, mode='r'):
+        """Open series file, and read index.
+
+        Parameters
+        ----------
+        filename : str
+            Full path of file
+        mode : str
+            'r' for reading, 'a' for appending. Creates file if needed
+        """
+        self.filename = filename
+        self.mode = mode
+        self.index = []
+        if mode == 'r':
+            self.fid = open(filename, 'rb')
+            self.data_end = self.read_index()
+        elif mode == 'a':
+            if os.path.isfile(filename):
+                self.fid = open(filename, 'r+b')
+                self.data_end = self.read_index()
+            else:
+                self.fid = open(filename, 'xb')
+                self.data_end = 0
+        else:
+            raise ValueError(f"Unknown mode '{mode}', use 'r' or 'a'")
+
+    def __enter__(self):
+        """Use as context manager, file is closed at exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Write index and close file when leaving context."""
+        self.close()
+
+    def __len__(self):
+        """Return number of traces in file."""
+        return len(self.index)
+
+    def __getitem__(self, k):
+        """Read trace no. k."""
+        return self.read(k)
+
+    def __iter__(self):
+        """Iterate over traces, reading one at a time."""
+        for k in range(len(self)):
+            yield self.read(k)
+
+    def read_index(self):
+        """Read index from end of file.
+
+        The index is rebuilt from the trace records if the file has no
+        trailer, i.e., it was not closed.
+
+        Returns
+        -------
+        index_offset : int
+            Position of index, i.e., end of trace data
+        """
+        self.fid.seek(0, os.SEEK_END)
+        if self.fid.tell() < SERIES_TRAILER_SIZE:
+            return self.scan_records()
+        self.fid.seek(-SERIES_TRAILER_SIZE, os.SEEK_END)
+        trailer = self.fid.read(SERIES_TRAILER_SIZE)
+        if trailer[16:] != SERIES_MAGIC:
+            return self.scan_records()
+        index_offset = int(np.frombuffer(trailer[0:8], dtype='>u8')[0])
+        n_traces = int(np.frombuffer(trailer[8:16], dtype='>u8')[0])
+
+        self.fid.seek(index_offset)
+        index = np.fromfile(self.fid, dtype=SERIES_INDEX, count=n_traces)
+        self.index = index.tolist()
+        return index_offset
+
+    def scan_records(self):
+        """Rebuild index by searching the file for trace records.
+
+        Used when the file was not closed, so the index is missing. Each
+        record starts with the same header, see write_header(), and a
+        record ends where the next one starts. A record that was not
+        completely written is shortened to the samples found. Records with
+        incomplete header or invalid no. of channels are skipped.
+
+        Returns
+        -------
+        data_end : int
+            Position of end of trace data
+        """
+        signature = (np.array(len(WFM_HEADER)).astype('>i4').tobytes()
+                     + bytes(WFM_HEADER, 'utf-8'))
+        header_size = len(signature) + 4 + 3*8   # n_channels, t0, dt, dtr
+        sample_size = np.dtype(SERIES_DTYPE).itemsize
+        self.index = []
+        self.fid.seek(0, os.SEEK_END)
+        file_size = self.fid.tell()
+        if file_size == 0:
+            return 0
+
+        with map_file(self.fid.fileno(), 0, access=ACCESS_READ) as content:
+            if content.find(signature, 0, len(signature)) != 0:
+                raise ValueError(f"{self.filename} is not a waveform "
+                                 "series file")
+            data_end = 0
+            offset = 0
+            while offset >= 0:
+                data_offset = offset + header_size
+                values = content[offset+len(signature):data_offset]  # Copy
+                n_ch = 0    # Header not complete, record is skipped
+                if len(values) == header_size - len(signature):
+                    n_ch = int(np.frombuffer(values[0:4], dtype='>u4')[0])
+                    t0, dt, dtr = np.frombuffer(values[4:], dtype='>f8')
+                next_offset = content.find(signature, offset+len(signature))
+                record_end = file_size if next_offset < 0 else next_offset
+                n_samples = 0
+                if 1 <= n_ch <= MAX_CHANNELS:    # Else corrupt header
+                    row_size = sample_size*n_ch
+                    n_samples = max(record_end - data_offset, 0) // row_size
+                if n_samples > 0:
+                    self.index.append((offset, data_offset, n_samples, n_ch,
+                                       float(t0), float(dt), float(dtr)))
+                    data_end = data_offset + row_size*n_samples
+                offset = next_offset
+
+        warnings.warn(f"{self.filename} was not closed, index rebuilt "
+                      f"from {len(self.index)} trace records")
+        return data_end
+
+    def read(self, k, mmap=False):
+        """Read trace no. k.
+
+        Parameters
+        ----------
+        k : int
+            Trace number, counted from 0
+        mmap : bool
+            Map data in file to memory instead of reading them
+
+        Returns
+        -------
+        wfm : Waveform class
+            Trace no. k
+        """
+        offset, data_offset, n_samples, n_ch, t0, dt, dtr = self.index[k]
+        shape = (n_samples, n_ch)
+        if mmap:
+            y = np.memmap(self.filename, dtype=SERIES_DTYPE, mode='r',
+                          offset=data_offset, shape=shape)
+        else:
+            self.fid.seek(data_offset)
+            y = np.fromfile(self.fid, dtype=SERIES_DTYPE,
+                            count=n_samples*n_ch)
+            y = np.reshape(y, shape)
+        wfm = Waveform(y, dt=dt, t0=t0)
+        wfm.dtr = dtr
+        wfm.sourcefile = self.filename
+        return wfm
+
+    def append(self, wfm):
+        """Append trace to end of file.
+
+        Parameters
+        ----------
+        wfm : Waveform class
+            Trace to append. Raw traces are scaled, series store floats
+        """
+        wfm = wfm.scaled()
+        self.fid.seek(self.data_end)
+        self.fid.truncate()       # Old index, rewritten at close
+        offset = self.data_end
+        write_header(self.fid, wfm.n_channels(), wfm.t0, wfm.dt, wfm.dtr)
+        data_offset = self.fid.tell()
+        self.fid.write(wfm.y.astype(SERIES_DTYPE, order='C'))
+        self.data_end = self.fid.tell()
+        self.index.append((offset, data_offset, wfm.n_samples(),
+                           wfm.n_channels(), wfm.t0, wfm.dt, wfm.dtr))
+        return 0
+
+    def append_file(self, filename):
+        """Append trace from single-trace file, from Waveform.save()."""
+        wfm = Waveform()
+        wfm.load(filename)
+        return self.append(wfm)
+
+    def export(self, k, filename):
+        """Save trace no. k to single-trace file, as from Waveform.save().
+
+        Parameters
+        ----------
+        k : int
+            Trace number, counted from 0
+        filename : str
+            Full path of file to save trace in
+        """
+        offset, data_offset, n_samples, n_ch = self.index[k][0:4]
+        record_end = data_offset + 4*n_samples*n_ch   # 4-byte (sgl) floats
+        self.fid.seek(offset)
+        record = self.fid.read(record_end - offset)
+        with open(filename, 'xb') as fid:
+            fid.write(record)
+        return 0
+
+    def close(self):
+        """Write index and trailer if appending, and close file."""
+        if self.fid.closed:
+            return 0
+        if self.mode == 'a':
+            self.fid.seek(self.data_end)
+            index = np.array(self.index, dtype=SERIES_INDEX)
+            self.fid.write(index.tobytes())
+            self.fid.write(np.array(self.data_end).astype('>u8'))
+            self.fid.write(np.array(len(self.index)).astype('>u8'))
+            self.fid.write(SERIES_MAGIC)
+            self.fid.truncate()
+        self.fid.close()
+        return 0
+
+
 # %% Utility functions
 
 def scale_125(x):
@@ -633,6 +1611,410 @@ def read_scaled_value(quantity):
     return value
 
 
+def read_header(filename):
+    """Read header of 'Waveform' binary file, without loading the data.
+
+    Parameters
+    ----------
+    filename : str
+        Full path of file
+
+    Returns
+    -------
+    info : WaveformFileInfo class
+        Header values and position and size of data in file
+    """
+    info = WaveformFileInfo()
+    file_size = os.path.getsize(filename)
+    with open(filename, 'rb') as fid:
+        n_header = int(np.fromfile(fid, dtype='>i4', count=1)[0])
+        if not 0 < n_header < file_size:
+            raise ValueError(f"{filename} has invalid header length "
+                             f"{n_header}")
+        header_bytes = fid.read(n_header)
+        info.header = header_bytes.decode("utf-8")
+
+        info.n_channels = int(np.fromfile(fid, dtype='>u4', count=1)[0])
+        info.t0 = float(np.fromfile(fid, dtype='>f8', count=1)[0])
+        info.dt = float(np.fromfile(fid, dtype='>f8', count=1)[0])
+        info.dtr = float(np.fromfile(fid, dtype='>f8', count=1)[0])
+        if info.header == WFM_HEADER_RAW:
+            info.dtype = '>i2'
+            scale = np.fromfile(fid, dtype='>f8', count=info.n_channels)
+            info.scale = scale.tolist()
+        info.data_offset = fid.tell()
+    if info.n_channels < 1 or info.data_offset > file_size:
+        raise ValueError(f"{filename} is not a complete waveform file")
+
+    n_bytes = file_size - info.data_offset
+    row_size = np.dtype(info.dtype).itemsize*info.n_channels
+    info.n_samples = n_bytes // row_size
+    info.sourcefile = filename
+    return info
+
+
+def scan_results(resultdir, ext=('wfm', 'trc'), recursive=False):
+    """List contents of all 'Waveform' files in a directory.
+
+    Reads only the headers. The result is cached in the file CATALOG_FILE
+    in the same directory, where each file is identified by its path
+    relative to the directory, modification time and size. Later scans
+    read only new or changed files, and files cached by older versions
+    without all fields in CATALOG_FIELDS. Files that cannot be read as
+    'Waveform' files are skipped with a warning. The error is cached, so
+    they are read and reported again only if they change.
+
+    Parameters
+    ----------
+    resultdir : str
+        Directory to scan
+    ext : str or List of str
+        File extensions to include
+    recursive : bool
+        Include files in subdirectories
+
+    Returns
+    -------
+    catalog : List of WaveformFileInfo class
+        Header information for each file, sorted by relative path
+    """
+    ext = (ext,) if isinstance(ext, str) else ext
+    catalogfile = os.path.join(resultdir, CATALOG_FILE)
+    cached = {}
+    if os.path.isfile(catalogfile):
+        try:
+            with open(catalogfile, 'rt') as fid:
+                cached = json.load(fid)
+        except ValueError:
+            warnings.warn(f"Catalog {catalogfile} is corrupt, rebuilt")
+
+    paths = []
+    for directory, subdirs, files in os.walk(resultdir):
+        paths += [os.path.relpath(os.path.join(directory, name), resultdir)
+                  for name in files
+                  if name.split('.')[-1].lower() in ext]
+        if not recursive:
+            break
+
+    entries = {}
+    changed = False
+    for name in sorted(paths):
+        stat = os.stat(os.path.join(resultdir, name))
+        fields = cached.get(name)
+        if (fields is None
+                or fields.get('mtime') != stat.st_mtime
+                or fields.get('size') != stat.st_size
+                or ('error' not in fields
+                    and any(field not in fields for field in CATALOG_FIELDS))):
+            fields = {'mtime': stat.st_mtime, 'size': stat.st_size}
+            try:
+                info = read_header(os.path.join(resultdir, name))
+                fields.update({field: getattr(info, field)
+                               for field in CATALOG_FIELDS})
+            except (ValueError, IndexError, UnicodeDecodeError,
+                    OSError) as error:
+                warnings.warn(f"Skipped {name}, not a waveform file: "
+                              f"{error}")
+                fields['error'] = str(error)    # Not read again if unchanged
+            changed = True
+        entries[name] = fields
+    changed = changed or (entries.keys() != cached.keys())
+
+    if changed:
+        with open(catalogfile, 'wt') as fid:
+            json.dump(entries, fid, indent=1)
+
+    catalog = []
+    for name, fields in entries.items():
+        if 'error' in fields:
+            continue    # Not a waveform file
+        info = WaveformFileInfo()
+        for field in CATALOG_FIELDS:
+            setattr(info, field, fields[field])
+        info.sourcefile = os.path.join(resultdir, name)
+        catalog.append(info)
+    return catalog
+
+
+@lru_cache(maxsize=32)
+def filter_sos(order, f_min, f_max, fs):
+    """Design Butterworth bandpass filter as second-order sections.
+
+    Cached, as the same filter is applied to every trace during
+    acquisition. Second-order sections are numerically stable also for
+    high filter orders and low cutoff frequencies.
+
+    Parameters
+    ----------
+    order : int
+        Filter order
+    f_min : float
+        Lower cutoff frequency
+    f_max : float
+        Upper cutoff frequency
+    fs : float
+        Sample rate
+
+    Returns
+    -------
+    sos : 2D array of float
+        Second-order sections. Shared by all callers, do not modify
+    """
+    wc = np.array([f_min, f_max])/(fs/2)   # Normalised to Nyquist-frequency
+    sos = signal.butter(order, wc, btype='bandpass', output='sos')
+    return sos
+
+
+@lru_cache(maxsize=16)
+def time_vector(t0, dt, n_samples):
+    """Time vector [s] from start time and sample interval.
+
+    Cached, as the same vector is used for every trace during acquisition.
+    Returned as read-only to protect the cached values.
+
+    Parameters
+    ----------
+    t0 : float
+        Time of first sample
+    dt : float
+        Sample interval
+    n_samples : int
+        Number of samples
+
+    Returns
+    -------
+    t : 1D array of float
+        Time vector, t0 + k*dt
+    """
+    t = t0 + dt*np.arange(n_samples)
+    t.setflags(write=False)
+    return t
+
+
+@lru_cache(maxsize=16)
+def frequency_vector(n_fft, dt):
+    """Frequency vector [Hz] for one-sided spectrum, 0 to Nyquist-frequency.
+
+    Points as from scipy.fft.rfft(), n_fft//2+1 values. Cached and
+    read-only, see time_vector()
+
+    Parameters
+    ----------
+    n_fft : int
+        Number of points in FFT
+    dt : float
+        Sample interval
+
+    Returns
+    -------
+    f : 1D array of float
+        Frequency vector
+    """
+    f = fft.rfftfreq(n_fft, dt)
+    f.setflags(write=False)
+    return f
+
+
+def load_many(paths, workers=8, stack=False, **kwargs):
+    """Load many 'Waveform' files in parallel.
+
+    Files are read in a pool of threads, as loading is limited by file
+    access, not by calculations. Useful on network drives.
+
+    Parameters
+    ----------
+    paths : str or List of str
+        File names, or a pattern as "results/us_*.trc"
+    workers : int
+        Number of files to read simultaneously
+    stack : bool
+        Return data from all files as one 3D array. Requires files with
+        identical number of samples and channels
+    kwargs : dict
+        Options passed to Waveform.load(), mmap, tlim, channels or raw
+
+    Returns
+    -------
+    wfm : List of Waveform class, or 3D array of float
+        Traces as loaded, or stacked data as trace x sample x channel.
+        Stacked data are scaled, also raw traces, and have the data type
+        of the scaled traces, e.g., float64 from raw files.
+        Empty list if no files are given, ValueError if stacked
+    """
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(paths))
+
+    def load_file(filename):
+        wfm = Waveform()
+        wfm.load(filename, **kwargs)
+        return wfm
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        wfm = list(pool.map(load_file, paths))
+
+    if not stack:
+        return wfm
+
+    shapes = {w.y.shape for w in wfm}
+    if not shapes:
+        raise ValueError("No files to stack, trace shape is unknown")
+    if len(shapes) > 1:
+        raise ValueError(f"Cannot stack traces of different shapes {shapes}")
+    dtype = np.result_type(*[w.y if w.scale is None
+                             else np.result_type(w.y, np.asarray(w.scale))
+                             for w in wfm])     # As after scaling
+    y = np.empty((len(wfm),) + shapes.pop(), dtype=dtype)
+    for k in range(len(wfm)):
+        if wfm[k].scale is None:
+            y[k] = wfm[k].y
+        else:
+            np.multiply(wfm[k].y, wfm[k].scale, out=y[k])
+    return y
+
+
+def write_header(fid, n_channels, t0, dt, dtr=0, scale=None):
+    """Write header of 'Waveform' binary file.
+
+    Data points are written after the header as 4-byte (sgl) floats,
+    complements read_header(). For raw files, scale factors for each
+    channel are written after dtr, and data points as 2-byte integers
+
+    Parameters
+    ----------
+    fid : file object
+        File opened for binary writing
+    n_channels : int
+        Number of data channels
+    t0 : float
+        Start time
+    dt : float
+        Sample interval
+    dtr : float
+        Interval between blocks. Used only in special cases
+    scale : 1D array of float
+        Scale factor for each channel. Raw file if not None
+    """
+    if scale is None:
+        header = WFM_HEADER        # Header gives source and data format
+    else:
+        header = WFM_HEADER_RAW
+    n_header = len(header)
+    fid.write(np.array(n_header).astype('>i4'))
+    fid.write(bytes(header, 'utf-8'))
+    fid.write(np.array(n_channels).astype('>u4'))
+    fid.write(np.array(t0).astype('>f8'))
+    fid.write(np.array(dt).astype('>f8'))
+    fid.write(np.array(dtr).astype('>f8'))
+    if scale is not None:
+        fid.write(np.broadcast_to(scale, (n_channels,)).astype('>f8'))
+    return 0
+
+
+def find_sample_range(tlim, t0, dt, n_samples):
+    """Find index range of samples inside a time interval.
+
+    Calculated from start time and sample interval, sample k is at time
+    t0 + k*dt
+
+    Parameters
+    ----------
+    tlim : List of float
+        Start and end of interval
+    t0 : float
+        Time of first sample
+    dt : float
+        Sample interval
+    n_samples : int
+        Number of samples in trace
+
+    Returns
+    -------
+    n_start : int
+        Index of first sample in interval
+    n_stop : int
+        Index after last sample in interval, as in n_start:n_stop
+    """
+    k_min = (min(tlim) - t0)/dt
+    k_max = (max(tlim) - t0)/dt
+    n_start = int(np.ceil(k_min - 1e-6))   # Tolerance for round-off
+    n_stop = int(np.floor(k_max + 1e-6)) + 1
+    n_start = min(max(n_start, 0), n_samples)
+    n_stop = min(max(n_stop, n_start), n_samples)
+    return n_start, n_stop
+
+
+def channel_index(channels):
+    """Index selecting channels in columns of a trace, slice if possible.
+
+    Indexing with a slice gives a view of the array, also of a
+    memory-mapped file, while indexing with a list copies the data
+
+    Parameters
+    ----------
+    channels : int or List of int
+        Channel numbers
+
+    Returns
+    -------
+    index : slice or List of int
+        Slice if channels are consecutive and increasing, else list
+    """
+    channels = np.atleast_1d(channels).tolist()
+    first = channels[0] if channels else -1
+    if first >= 0 and channels == list(range(first, first+len(channels))):
+        return slice(first, first+len(channels))
+    return channels
+
+
+def decimate_minmax(t, y, n_bins):
+    """Reduce trace to min. and max. values in n_bins intervals, for display.
+
+    The envelope of the trace is kept, so peaks are not lost when a trace
+    with many more samples than screen pixels is plotted. Each interval
+    gives two points, the minimum and the maximum value, placed at the
+    start and the middle of the interval. Traces with less than 2*n_bins
+    samples are returned unchanged.
+
+    Parameters
+    ----------
+    t : 1D array of float
+        Time vector
+    y : 2D array of float
+        Samples as rows, channels as columns
+    n_bins : int
+        Number of intervals, e.g., width of plot in pixels
+
+    Returns
+    -------
+    t_dec : 1D array of float
+        Time vector, 2 points per interval
+    y_dec : 2D array of float
+        Minimum and maximum value in each interval
+    """
+    n_samples = len(y)
+    n_bins = max(int(n_bins), 1)
+    if n_samples <= 2*n_bins:
+        return t, y
+    bin_size = -(-n_samples // n_bins)      # Round up
+    n_full = n_samples // bin_size          # Complete intervals
+    n_bins = -(-n_samples // bin_size)
+
+    y_2d = y.reshape((n_samples, -1))
+    blocks = y_2d[:n_full*bin_size].reshape((n_full, bin_size, -1))
+    y_dec = np.empty((2*n_bins, y_2d.shape[1]), dtype=y.dtype)
+    blocks.min(axis=1, out=y_dec[0:2*n_full:2])
+    blocks.max(axis=1, out=y_dec[1:2*n_full:2])
+    if n_full < n_bins:                     # Last interval is shorter
+        y_2d[n_full*bin_size:].min(axis=0, out=y_dec[-2])
+        y_2d[n_full*bin_size:].max(axis=0, out=y_dec[-1])
+
+    start = np.arange(0, n_samples, bin_size)
+    t_dec = np.empty(2*n_bins)
+    t_dec[0::2] = t[start]
+    t_dec[1::2] = t[np.minimum(start + bin_size//2, n_samples-1)]
+    return t_dec, y_dec.reshape((2*n_bins,) + y.shape[1:])
+
+
 def find_filename(prefix='test', ext='trc', resultdir="..\\results"):
     """Find new file name from date and counter.
 
@@ -722,17 +2104,20 @@ def plot_pulse(ax, t, x, time_unit="s", y_max=None):
 
 
 def powerspectrum(y, dt, n_fft=None,
-                  scale="linear", normalise=False, transpose=True):
+                  scale="linear", normalise=False, transpose=None, axis=0):
     """Calculate power spectrum of pulse. Finite length signal, no window.
 
     Datapoints in rows (dimension 0)
     Channels in (dimension 1)
-    Transposed to fit definition of periodogram function in SciPy
+    Calculated by real FFT along the sample axis, no transpose needed.
+    Scaled as power spectral density, identical to periodogram in SciPy.
+    Frequency vector and scaling are cached. A 3D stack of traces, e.g.
+    from load_many(), is calculated in one call by setting axis=1
 
     Parameters
     ----------
-    x : 1D array of float
-        Time trace
+    x : 1D, 2D or 3D array of float
+        Time trace(s)
     dt : float
         Sample interval
     n_fft : int
@@ -741,6 +2126,10 @@ def powerspectrum(y, dt, n_fft=None,
         Linear (power) or dB
     normalise : Booloean
         Normalise spectrum to max value
+    transpose : bool
+        Deprecated, not used. Warns if given
+    axis : int
+        Axis with samples
 
     Returns
     -------
@@ -749,22 +2138,60 @@ def powerspectrum(y, dt, n_fft=None,
     psd : 2D aray of float
         Power spectral density
     """
-    y = y.transpose()
-    f, psd = signal.periodogram(y, fs=1/dt, nfft=n_fft, detrend=False)
-    psd = psd.transpose()  # Periodogram function calculates along dimension 1
+    if transpose is not None:
+        warnings.warn("powerspectrum(): transpose is not used, samples "
+                      "are along axis", DeprecationWarning, stacklevel=2)
+    n_samples = y.shape[axis]
+    if n_fft is None:
+        n_fft = n_samples
+    f, psd_scale = spectrum_scaling(n_samples, n_fft, dt)
+
+    y_fft = fft.rfft(y, n=n_fft, axis=axis)
+    psd = y_fft.real**2
+    psd += y_fft.imag**2
+    shape = [1]*psd.ndim
+    shape[axis] = -1
+    psd *= psd_scale.reshape(shape)
 
     if normalise:
-        if psd.ndim == 1:
-            psd = psd/psd.max()
-        else:
-            n_ch = psd.shape[1]
-            for k in range(n_ch):
-                psd[:, k] = psd[:, k]/psd[:, k].max()
+        psd /= psd.max(axis=axis, keepdims=True)
     if scale.lower() == "db":
         psd = 10*np.log10(psd)
     return f, psd
 
 
+@lru_cache(maxsize=16)
+def spectrum_scaling(n_samples, n_fft, dt):
+    """Frequency vector and scaling for one-sided power spectral density.
+
+    Cached, see powerspectrum(). Returned as read-only arrays.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples in trace
+    n_fft : int
+        Number of points in FFT
+    dt : float
+        Sample interval
+
+    Returns
+    -------
+    f : 1D array of float
+        Frequency vector, 0 to Nyquist-frequency
+    psd_scale : 1D array of float
+        Scaling from squared magnitude of FFT to power spectral density
+    """
+    f = frequency_vector(n_fft, dt)
+    n_used = max(min(n_samples, n_fft), 1)   # Truncated if n_fft is shorter
+    psd_scale = np.full(len(f), 2*dt/n_used)   # One-sided, doubled
+    psd_scale[0] /= 2                 # DC and Nyquist are not doubled
+    if n_fft % 2 == 0:
+        psd_scale[-1] /= 2
+    psd_scale.setflags(write=False)
+    return f, psd_scale
+
+
 def plot_spectrum(t, x, time_unit="s",
                   y_max=None, f_max=None, n_fft=None,
                   scale="dB", normalise=True, db_min=-40, ax=None):